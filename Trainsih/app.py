@@ -1,9 +1,12 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 from flask_cors import CORS
 import json
-from scenario_runner import parse_scenario, build_network, build_trains, enforce_headway, detect_block_conflicts, decide_precedence, run_simulation, compute_kpis
+from scenario_runner import parse_scenario, build_network, build_trains, name_conflicts, enforce_headway, detect_block_conflicts, decide_precedence, run_simulation
 from scenario_schema import Scenario
+from rail_decision_engine import KpiAccumulator, format_event, iter_simulation
 from gemini_integration_fixed import analyze_scenario_with_ai
+from rescheduler import reschedule
+from what_if import cached_base_state, what_if
 
 app = Flask(__name__)
 CORS(app, origins=['*'])  # Enable CORS for all origins
@@ -30,9 +33,9 @@ def run_scenario():
         
         scn = parse_scenario(data)
         network = build_network(scn.sections)
-        trains = build_trains(scn)
+        trains = build_trains(scn, network=network)
         enforce_headway(trains, scn.constraints.min_headway_min)
-        conflicts = detect_block_conflicts(trains)
+        conflicts = name_conflicts(network, detect_block_conflicts(trains, network.capacities))
         
         # Print conflicts in required format
         for conflict in conflicts:
@@ -60,10 +63,23 @@ def run_scenario():
         # Format decisions
         decisions_dict = {tid: action for tid, action in decisions.items()}
 
+        # Suggested holds for the scenario's optimization goal; the search gives up after a
+        # few hundred iterations without improvement, so 200 ms is only a ceiling
+        plan = reschedule(trains, network.capacities, scn.simulation.optimization_goal, budget_ms=200.0)
+
         return jsonify({
             'conflicts': conflicts_list,
             'decisions': decisions_dict,
-            'trains': [{'id': t.train_id, 'path': t.planned_path} for t in trains]
+            'trains': [{'id': t.train_id, 'path': t.planned_path} for t in trains],
+            'reschedule': {
+                'goal': plan.goal,
+                'holds_min': plan.delays,
+                'initial_cost': plan.initial_cost,
+                'best_cost': plan.best_cost,
+                'remaining_conflicts': plan.remaining_conflicts,
+                'iterations': plan.iterations,
+                'elapsed_ms': plan.elapsed_ms
+            }
         })
     except Exception as e:
         print(f"Error in run_scenario: {e}")
@@ -78,15 +94,17 @@ def analyze_scenario():
 
         scn = parse_scenario(data)
         network = build_network(scn.sections)
-        trains = build_trains(scn)
+        trains = build_trains(scn, network=network)
         enforce_headway(trains, scn.constraints.min_headway_min)
-        conflicts = detect_block_conflicts(trains)
+        conflicts = name_conflicts(network, detect_block_conflicts(trains, network.capacities))
         id_pairs = {tuple(sorted((a, b))) for _, a, b, _ in conflicts}
         decisions = decide_precedence(list(id_pairs), {t.train_id: t for t in trains})
         
         # Run simulation for event log and KPIs
-        sim_log = run_simulation(trains)
-        kpis = compute_kpis(trains, sim_log)
+        kpi_acc = KpiAccumulator()
+        blocking = scn.simulation.simulation_mode == 'blocking'
+        sim_log = run_simulation(trains, kpi_acc, blocking=blocking, capacities=network.capacities)
+        kpis = kpi_acc.result()
         
         # Format conflicts for analysis
         conflicts_list = []
@@ -100,7 +118,7 @@ def analyze_scenario():
 
         # Generate detailed AI analysis with Gemini
         gemini_result = analyze_scenario_with_ai(conflicts, decisions)
-        analysis = generate_ai_analysis(conflicts_list, decisions, trains, kpis, sim_log, scn)
+        analysis = generate_ai_analysis(conflicts_list, decisions, trains, kpis, sim_log, scn, network)
         
         # Add Gemini analysis to response
         analysis['gemini_output'] = gemini_result['algorithm_output']
@@ -110,7 +128,7 @@ def analyze_scenario():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-def generate_ai_analysis(conflicts, decisions, trains, kpis, sim_log, scn):
+def generate_ai_analysis(conflicts, decisions, trains, kpis, sim_log, scn, network=None):
     """Generate structured AI analysis based on the requested format"""
     
     # 1. Analyze conflicts and decisions
@@ -166,11 +184,13 @@ def generate_ai_analysis(conflicts, decisions, trains, kpis, sim_log, scn):
     
     # 5. Event log (first 10 events)
     event_log = []
-    for i, log_entry in enumerate(sim_log[:10]):
+    symbols = network.symbols if network is not None else None
+    for ev in sim_log[:10]:
+        # typed events are rendered here; block names may contain spaces, so split at most twice
         event_log.append({
-            'timestamp': log_entry.split()[0],
-            'action': log_entry.split()[1],
-            'details': ' '.join(log_entry.split()[2:])
+            'timestamp': f"{ev.time:.1f}",
+            'action': ev.kind.name,
+            'details': format_event(ev, symbols).split(' ', 2)[2]
         })
     
     # 6. Fairness assessment
@@ -215,6 +235,58 @@ def generate_ai_analysis(conflicts, decisions, trains, kpis, sim_log, scn):
         }
     }
 
+@app.route('/simulate_stream', methods=['POST'])
+def simulate_stream():
+    # Streams the event log line by line as the simulation runs, ending with a KPI JSON line
+    data = request.get_json()
+    if not data:
+        return jsonify({'error': 'No JSON data provided'}), 400
+    try:
+        scn = parse_scenario(data)
+        network = build_network(scn.sections)
+        trains = build_trains(scn, network=network)
+        enforce_headway(trains, scn.constraints.min_headway_min)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+    def generate():
+        kpi_acc = KpiAccumulator()
+        blocking = scn.simulation.simulation_mode == 'blocking'
+        for ev in iter_simulation(trains, [kpi_acc], blocking, network.capacities):
+            yield format_event(ev, network.symbols) + "\n"
+        yield json.dumps({'kpis': kpi_acc.result()}) + "\n"
+
+    return Response(generate(), mimetype='text/plain')
+
+@app.route('/what_if', methods=['POST'])
+def what_if_endpoint():
+    # Body: the scenario (top level or under 'scenario') plus 'perturbations': {train_id: minutes late}.
+    # The base run is cached per scenario, so repeated questions only pay for the perturbation.
+    try:
+        data = request.get_json()
+        if not data:
+            return jsonify({'error': 'No JSON data provided'}), 400
+        perturbations = {str(k): float(v) for k, v in (data.get('perturbations') or {}).items()}
+        scenario = data.get('scenario') or {k: v for k, v in data.items() if k != 'perturbations'}
+        base = cached_base_state(scenario)
+        unknown = [tid for tid in perturbations if tid not in base.trains]
+        if unknown:
+            return jsonify({'error': f"Unknown train(s): {', '.join(unknown)}"}), 400
+        result = what_if(base, perturbations)
+        return jsonify({
+            'perturbations': result.perturbations,
+            'conflicts_added': [{'block': c[0], 'train_a': c[1], 'train_b': c[2], 'overlap': c[3]} for c in result.added_conflicts],
+            'conflicts_removed': [{'block': c[0], 'train_a': c[1], 'train_b': c[2], 'overlap': c[3]} for c in result.removed_conflicts],
+            'decisions_changed': {tid: {'base': b, 'new': a} for tid, (b, a) in result.changed_decisions.items()},
+            'delay_changes_min': result.delay_changes,
+            'kpis': result.kpis,
+            'kpi_delta': result.kpi_delta,
+            'base_kpis': base.kpis,
+            'elapsed_ms': result.elapsed_ms
+        })
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/health', methods=['GET'])
 def health():
     return jsonify({'status': 'ok', 'message': 'Backend is running'})
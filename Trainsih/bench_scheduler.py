@@ -0,0 +1,82 @@
+"""Benchmark the simulator's event-queue backends.
+
+Two workloads per size:
+  hold  - the classic hold model: pop the earliest event, push one a little later,
+          with as many pending events as there are trains (the simulator's pattern)
+  sim   - a full run_simulation over random trains producing that many events
+
+    python bench_scheduler.py --events 100000 1000000 10000000 --skip-sim-above 1000000
+"""
+
+import argparse
+from functools import partial
+import random
+import time
+
+from rail_decision_engine import BlockOccupancy, CalendarQueue, HeapScheduler, Train, run_simulation
+
+
+BACKENDS = {
+    "heap": HeapScheduler,
+    "calendar": CalendarQueue,
+}  # calendar is re-bound to the --width given on the command line
+
+
+def bench_hold(make, events: int, pending: int, seed: int = 0) -> float:
+    rng = random.Random(seed)
+    queue = make()
+    for i in range(pending):
+        queue.push((rng.uniform(0.0, 60.0), i))
+    gaps = [rng.uniform(0.5, 5.0) for _ in range(4096)]
+    clock = time.perf_counter()
+    for k in range(events):
+        t, i = queue.pop()
+        queue.push((t + gaps[k & 4095], i))
+    return time.perf_counter() - clock
+
+
+def make_trains(events: int, blocks: int = 500, legs: int = 10, seed: int = 0):
+    # each train yields 2 * legs events, departures spread so ~200 trains run at once
+    rng = random.Random(seed)
+    n = max(1, events // (2 * legs))
+    horizon = n * legs * 3.0 / 200.0
+    trains = []
+    for i in range(n):
+        s = rng.uniform(0.0, horizon)
+        occ = []
+        for _ in range(legs):
+            d = rng.uniform(1.0, 5.0)
+            occ.append(BlockOccupancy(rng.randrange(blocks), s, s + d))
+            s += d
+        trains.append(Train(f"T{i}", "freight", rng.randint(1, 5), [], occ))
+    return trains
+
+
+def bench_sim(make, trains) -> float:
+    clock = time.perf_counter()
+    run_simulation(trains, keep_log=False, scheduler=make())
+    return time.perf_counter() - clock
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--events", type=int, nargs="+", default=[100_000, 1_000_000])
+    parser.add_argument("--pending", type=int, default=10_000, help="Pending events in the hold model")
+    parser.add_argument("--width", type=float, default=1.0, help="Calendar bucket width in minutes")
+    parser.add_argument("--skip-sim-above", type=int, default=1_000_000, help="Largest size for the full simulation")
+    args = parser.parse_args()
+    BACKENDS["calendar"] = partial(CalendarQueue, args.width)
+
+    print(f"{'workload':<8} {'events':>10} " + " ".join(f"{name + ' s':>12}" for name in BACKENDS) + f" {'speedup':>8}")
+    for events in args.events:
+        times = [bench_hold(make, events, args.pending) for make in BACKENDS.values()]
+        print(f"{'hold':<8} {events:>10} " + " ".join(f"{t:>12.3f}" for t in times) + f" {times[0] / times[1]:>8.2f}")
+        if events > args.skip_sim_above:
+            continue
+        trains = make_trains(events)
+        times = [bench_sim(make, trains) for make in BACKENDS.values()]
+        print(f"{'sim':<8} {events:>10} " + " ".join(f"{t:>12.3f}" for t in times) + f" {times[0] / times[1]:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
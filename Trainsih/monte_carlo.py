@@ -0,0 +1,200 @@
+from __future__ import annotations
+
+import json
+import math
+import random
+import statistics
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from rail_decision_engine import BlockKey, BlockOccupancy, KpiAccumulator, Train, run_simulation
+from scenario_schema import Scenario
+from scenario_runner import build_network, build_trains, enforce_headway, parse_scenario
+
+
+# -----------------------------
+# Monte Carlo delay perturbation
+# -----------------------------
+
+
+@dataclass
+class PerturbationModel:
+    # Each replica draws a departure offset per train, uniform in [-jitter, +jitter]
+    # minutes, and slows a random fraction of the sections by ``slow_factor``.
+    departure_jitter_min: float = 5.0
+    slow_section_fraction: float = 0.1
+    slow_factor: float = 1.2
+    blocking: bool = False  # run replicas through the blocking simulator
+
+
+@dataclass
+class CompiledScenario:
+    """Everything a replica needs, built once and shipped to each worker once."""
+
+    trains: List[Train]
+    capacities: Dict[BlockKey, int]
+    min_headway_min: float
+    section_blocks: List[Tuple[BlockKey, ...]]  # blocks of each section, both directions
+
+    @classmethod
+    def from_scenario(cls, scn: Scenario) -> "CompiledScenario":
+        network = build_network(scn.sections)
+        trains = build_trains(scn, network=network)
+        sections: Dict[Tuple[BlockKey, ...], None] = {}
+        for s in scn.sections:
+            blocks = {network.block_id(s.from_node, s.to_node)}
+            if s.availability in ("double", "loop"):
+                blocks.add(network.block_id(s.to_node, s.from_node))
+            sections[tuple(sorted(blocks, key=repr))] = None
+        return cls(trains, dict(network.capacities), scn.constraints.min_headway_min, list(sections))
+
+
+@dataclass
+class KpiSummary:
+    mean: float
+    std: float
+    ci_low: float  # 95% confidence interval of the mean (normal approximation)
+    ci_high: float
+    p05: float
+    p50: float
+    p95: float
+
+
+@dataclass
+class MonteCarloResult:
+    replicas: int
+    seed: int
+    workers: int
+    elapsed_ms: float
+    kpis: Dict[str, KpiSummary] = field(default_factory=dict)
+    samples: List[Dict[str, float]] = field(default_factory=list)  # per-replica KPIs, in seed order
+
+
+def perturb(compiled: CompiledScenario, model: PerturbationModel, rng: random.Random) -> List[Train]:
+    # Fresh copies of the compiled trains with jittered departures and stretched slow sections.
+    # delay_minutes is the arrival delay against the unperturbed plan (early arrivals count 0).
+    k = min(len(compiled.section_blocks), round(model.slow_section_fraction * len(compiled.section_blocks)))
+    slow = {b for blocks in rng.sample(compiled.section_blocks, k) for b in blocks}
+    trains: List[Train] = []
+    for t in compiled.trains:
+        jitter = rng.uniform(-model.departure_jitter_min, model.departure_jitter_min)
+        occupancies: List[BlockOccupancy] = []
+        shift = jitter
+        for occ in t.occupancies:
+            run = occ.end_time - occ.start_time
+            start = occ.start_time + shift
+            if occ.block_id in slow:
+                shift += run * (model.slow_factor - 1.0)
+            occupancies.append(BlockOccupancy(occ.block_id, start, occ.end_time + shift))
+        trains.append(Train(t.train_id, t.category, t.priority, t.planned_path, occupancies, t.delay_minutes))
+    return trains
+
+
+def _replica(compiled: CompiledScenario, model: PerturbationModel, seed: int, index: int) -> Dict[str, float]:
+    rng = random.Random(f"{seed}:{index}")
+    trains = perturb(compiled, model, rng)
+    enforce_headway(trains, compiled.min_headway_min)
+    for t, base in zip(trains, compiled.trains):
+        if t.occupancies:
+            t.delay_minutes = base.delay_minutes + max(0.0, t.occupancies[-1].end_time - base.occupancies[-1].end_time)
+    acc = KpiAccumulator()
+    run_simulation(trains, acc, keep_log=False, blocking=model.blocking, capacities=compiled.capacities)
+    return acc.result()
+
+
+# Per-process copy of the scenario, installed once by the pool initializer
+_WORKER_STATE: Optional[Tuple[CompiledScenario, PerturbationModel, int]] = None
+
+
+def _init_worker(compiled: CompiledScenario, model: PerturbationModel, seed: int) -> None:
+    global _WORKER_STATE
+    _WORKER_STATE = (compiled, model, seed)
+
+
+def _worker_replica(index: int) -> Dict[str, float]:
+    compiled, model, seed = _WORKER_STATE  # type: ignore[misc]
+    return _replica(compiled, model, seed, index)
+
+
+def _quantile(values: List[float], q: float) -> float:
+    # Linear interpolation between order statistics
+    pos = q * (len(values) - 1)
+    lo = math.floor(pos)
+    hi = min(lo + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (pos - lo)
+
+
+def summarize(samples: List[Dict[str, float]]) -> Dict[str, KpiSummary]:
+    summary: Dict[str, KpiSummary] = {}
+    if not samples:
+        return summary
+    for key in samples[0]:
+        values = sorted(float(s[key]) for s in samples)
+        mean = statistics.fmean(values)
+        std = statistics.stdev(values) if len(values) > 1 else 0.0
+        half = 1.96 * std / math.sqrt(len(values))
+        summary[key] = KpiSummary(
+            mean=mean,
+            std=std,
+            ci_low=mean - half,
+            ci_high=mean + half,
+            p05=_quantile(values, 0.05),
+            p50=_quantile(values, 0.50),
+            p95=_quantile(values, 0.95),
+        )
+    return summary
+
+
+def run_monte_carlo(
+    scenario: "Scenario | CompiledScenario",
+    model: Optional[PerturbationModel] = None,
+    replicas: int = 100,
+    seed: int = 0,
+    workers: int = 0,
+) -> MonteCarloResult:
+    """Run ``replicas`` perturbed copies of the scenario and aggregate their KPIs.
+
+    Replica i draws from its own generator seeded by (seed, i), so results do not depend
+    on the worker count or scheduling. With workers > 1 the replicas are spread over a
+    process pool whose initializer receives the compiled scenario once per worker.
+    """
+    clock = time.perf_counter()
+    model = model or PerturbationModel()
+    compiled = scenario if isinstance(scenario, CompiledScenario) else CompiledScenario.from_scenario(scenario)
+    if workers > 1 and replicas > 1:
+        chunk = max(1, replicas // (workers * 4))
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(compiled, model, seed)) as pool:
+            samples = list(pool.map(_worker_replica, range(replicas), chunksize=chunk))
+    else:
+        samples = [_replica(compiled, model, seed, i) for i in range(replicas)]
+    return MonteCarloResult(
+        replicas=replicas,
+        seed=seed,
+        workers=max(1, workers),
+        elapsed_ms=(time.perf_counter() - clock) * 1000.0,
+        kpis=summarize(samples),
+        samples=samples,
+    )
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument("scenario", help="Path to scenario JSON file")
+    parser.add_argument("--replicas", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=0)
+    parser.add_argument("--jitter", type=float, default=5.0, help="Departure jitter, +/- minutes")
+    parser.add_argument("--slow_fraction", type=float, default=0.1, help="Fraction of sections running slow")
+    parser.add_argument("--slow_factor", type=float, default=1.2, help="Running-time multiplier on slow sections")
+    parser.add_argument("--blocking", action="store_true", help="Trains queue at occupied blocks")
+    args = parser.parse_args()
+    with open(args.scenario, "r", encoding="utf-8") as f:
+        scn = parse_scenario(json.load(f))
+    model = PerturbationModel(args.jitter, args.slow_fraction, args.slow_factor, args.blocking)
+    result = run_monte_carlo(scn, model, args.replicas, args.seed, args.workers)
+    print(f"{result.replicas} replicas on {result.workers} worker(s) in {result.elapsed_ms:.0f} ms")
+    for key, s in result.kpis.items():
+        print(f"{key:>18}: mean {s.mean:.3f} [{s.ci_low:.3f}, {s.ci_high:.3f}]  p05 {s.p05:.3f}  p50 {s.p50:.3f}  p95 {s.p95:.3f}")
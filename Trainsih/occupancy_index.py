@@ -0,0 +1,327 @@
+from __future__ import annotations
+
+import heapq
+import random
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+from rail_decision_engine import BlockKey, BlockOccupancy, Train
+
+
+# -----------------------------
+# Per-block occupancy index
+# -----------------------------
+
+
+# (start_time, insertion seq, end_time, train_id); seq keeps equal starts in insertion order
+_Entry = Tuple[float, int, float, str]
+
+PROBE_ID = "__probe__"
+
+
+class _Node:
+    __slots__ = ("entry", "prio", "left", "right", "max_end")
+
+    def __init__(self, entry: _Entry, prio: float) -> None:
+        self.entry = entry
+        self.prio = prio
+        self.left: Optional[_Node] = None
+        self.right: Optional[_Node] = None
+        self.max_end = entry[2]
+
+
+def _fix(node: _Node) -> _Node:
+    m = node.entry[2]
+    if node.left is not None and node.left.max_end > m:
+        m = node.left.max_end
+    if node.right is not None and node.right.max_end > m:
+        m = node.right.max_end
+    node.max_end = m
+    return node
+
+
+class IntervalTree:
+    """Occupancies of one block in a treap ordered by (start, seq), each subtree
+    annotated with its latest end time.
+
+    Inserts and removals are O(log n) expected. A window query walks in start order,
+    skipping every subtree whose latest end is at or before the window start and
+    stopping at the first start past the window end, so one long occupancy no longer
+    widens every probe on its block.
+    """
+
+    _rng = random.Random(0)  # treap priorities; seeded so the shape is reproducible
+
+    def __init__(self) -> None:
+        self._root: Optional[_Node] = None
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _split(self, node: Optional[_Node], key: _Entry) -> Tuple[Optional[_Node], Optional[_Node]]:
+        # (entries < key, entries >= key)
+        if node is None:
+            return None, None
+        if node.entry < key:
+            node.right, right = self._split(node.right, key)
+            return _fix(node), right
+        left, node.left = self._split(node.left, key)
+        return left, _fix(node)
+
+    def _merge(self, a: Optional[_Node], b: Optional[_Node]) -> Optional[_Node]:
+        # every entry of a sorts before every entry of b
+        if a is None:
+            return b
+        if b is None:
+            return a
+        if a.prio > b.prio:
+            a.right = self._merge(a.right, b)
+            return _fix(a)
+        b.left = self._merge(a, b.left)
+        return _fix(b)
+
+    def insert(self, entry: _Entry) -> None:
+        left, right = self._split(self._root, entry)
+        self._root = self._merge(self._merge(left, _Node(entry, self._rng.random())), right)
+        self._size += 1
+
+    def remove(self, entry: _Entry) -> bool:
+        parent: Optional[_Node] = None
+        node = self._root
+        while node is not None and node.entry != entry:
+            parent = node
+            node = node.left if entry < node.entry else node.right
+        if node is None:
+            return False
+        joined = self._merge(node.left, node.right)
+        if parent is None:
+            self._root = joined
+        elif parent.left is node:
+            parent.left = joined
+        else:
+            parent.right = joined
+        self._size -= 1
+        # the removed entry may have carried the latest end of the path above it
+        self._refresh_path(entry)
+        return True
+
+    def _refresh_path(self, key: _Entry) -> None:
+        path: List[_Node] = []
+        node = self._root
+        while node is not None:
+            path.append(node)
+            node = node.left if key < node.entry else node.right
+        for node in reversed(path):
+            _fix(node)
+
+    def walk(self, after: float, before: Tuple = (float("inf"),)) -> Iterator[_Entry]:
+        # Entries in start order with end > after and (start, seq) < before
+        stack: List[_Node] = []
+        node = self._root
+        while True:
+            while node is not None and node.max_end > after:
+                stack.append(node)
+                node = node.left
+            if not stack:
+                return
+            node = stack.pop()
+            if node.entry >= before:
+                return
+            if node.entry[2] > after:
+                yield node.entry
+            node = node.right
+
+    def __iter__(self) -> Iterator[_Entry]:
+        return self.walk(-float("inf"))
+
+
+class OccupancyIndex:
+    """Interval-tree index of block occupancies supporting incremental updates.
+
+    Each block keeps its occupancies in an ``IntervalTree``, so probing a candidate
+    route costs O(hops * log n + overlaps) instead of re-running conflict detection
+    over every train already scheduled, and trains are added or removed in O(log n)
+    per occupancy.
+    """
+
+    def __init__(self, capacities: Optional[Dict[BlockKey, int]] = None) -> None:
+        self.capacities: Dict[BlockKey, int] = dict(capacities or {})
+        self._blocks: Dict[BlockKey, IntervalTree] = {}
+        # what was inserted per train, so removal works even after the train's occupancies moved
+        self._by_train: Dict[str, List[Tuple[BlockKey, _Entry]]] = {}
+        self._seq = 0
+
+    @classmethod
+    def from_trains(cls, trains: Iterable[Train], capacities: Optional[Dict[BlockKey, int]] = None) -> "OccupancyIndex":
+        index = cls(capacities)
+        for t in trains:
+            index.insert(t)
+        return index
+
+    def __len__(self) -> int:
+        return len(self._by_train)
+
+    def __contains__(self, train_id: str) -> bool:
+        return train_id in self._by_train
+
+    def insert(self, train: Train) -> None:
+        if train.train_id in self._by_train:
+            self.remove(train.train_id)
+        records: List[Tuple[BlockKey, _Entry]] = []
+        for occ in train.occupancies:
+            entry = (occ.start_time, self._seq, occ.end_time, train.train_id)
+            self._seq += 1
+            tree = self._blocks.get(occ.block_id)
+            if tree is None:
+                tree = self._blocks[occ.block_id] = IntervalTree()
+            tree.insert(entry)
+            records.append((occ.block_id, entry))
+        self._by_train[train.train_id] = records
+
+    def remove(self, train: Union[Train, str]) -> None:
+        train_id = train if isinstance(train, str) else train.train_id
+        for block_id, entry in self._by_train.pop(train_id, []):
+            tree = self._blocks[block_id]
+            tree.remove(entry)
+            if not tree:
+                del self._blocks[block_id]
+
+    def update(self, train: Train, legs: Optional[Iterable[int]] = None) -> None:
+        # Re-index a train whose occupancies were shifted in place; with ``legs`` only
+        # those occupancies (positions on its path) are touched
+        records = self._by_train.get(train.train_id)
+        if legs is None or records is None or len(records) != len(train.occupancies):
+            self.insert(train)
+            return
+        for k in legs:
+            block_id, entry = records[k]
+            occ = train.occupancies[k]
+            if occ.block_id != block_id:
+                self.insert(train)  # route changed: rebuild the whole train
+                return
+            self._blocks[block_id].remove(entry)
+            entry = (occ.start_time, self._seq, occ.end_time, train.train_id)
+            self._seq += 1
+            self._blocks[block_id].insert(entry)
+            records[k] = (block_id, entry)
+
+    def overlapping(
+        self, block_id: BlockKey, start: float, end: float, exclude: Optional[str] = None
+    ) -> List[Tuple[str, float, float]]:
+        tree = self._blocks.get(block_id)
+        if tree is None:
+            return []
+        # a zero-length probe still meets the occupancies that entered at the same instant
+        before = (end,) if end > start else (end, float("inf"))
+        return [(tid, s, e) for s, _, e, tid in tree.walk(start, before) if tid != exclude]
+
+    def query_route(
+        self, occupancies: List[BlockOccupancy], train_id: str = PROBE_ID
+    ) -> List[Tuple[BlockKey, str, str, Tuple[float, float]]]:
+        """Conflicts the given occupancies would have with the indexed trains.
+
+        Results use the ``detect_block_conflicts`` tuple layout with the probed train
+        reported second, and honour block capacities the same way: a pair is only a
+        conflict when it pushes the block above its capacity.
+        """
+        conflicts: List[Tuple[BlockKey, str, str, Tuple[float, float]]] = []
+        for occ in occupancies:
+            s, e = occ.start_time, occ.end_time
+            others = self.overlapping(occ.block_id, s, e, exclude=train_id)
+            if not others:
+                continue
+            capacity = max(1, self.capacities.get(occ.block_id, 1))
+            if capacity > 1:
+                others = self._over_capacity(s, e, others, capacity)
+            for other, os_, oe in others:
+                conflicts.append((occ.block_id, other, train_id, (max(os_, s), min(oe, e))))
+        return conflicts
+
+    def block_conflicts(
+        self, block_id: BlockKey, overlay: Optional[Dict[str, List[BlockOccupancy]]] = None
+    ) -> List[Tuple[BlockKey, str, str, Tuple[float, float]]]:
+        # Every conflict on one block, by the detect_block_conflicts sweep over the sorted
+        # entries (equal starts in insertion order rather than train-list order). Trains
+        # in ``overlay`` are swept with the given occupancies instead of their indexed
+        # ones, as if re-inserted, without modifying the index.
+        tree = self._blocks.get(block_id)
+        entries: Iterable[_Entry] = tree if tree is not None else ()
+        if overlay:
+            seq = self._seq
+            extra: List[_Entry] = []
+            for tid, occupancies in overlay.items():
+                for occ in occupancies:
+                    if occ.block_id == block_id:
+                        extra.append((occ.start_time, seq, occ.end_time, tid))
+                    seq += 1
+            extra.sort()
+            entries = heapq.merge((x for x in entries if x[3] not in overlay), extra)
+        capacity = max(1, self.capacities.get(block_id, 1))
+        conflicts: List[Tuple[BlockKey, str, str, Tuple[float, float]]] = []
+        active: Dict[int, Tuple[str, float, float]] = {}
+        ends: List[Tuple[float, int]] = []
+        for j, (sj, _, ej, tj) in enumerate(entries):
+            while ends and ends[0][0] <= sj:
+                del active[heapq.heappop(ends)[1]]
+            if len(active) >= capacity:
+                for ti, si, ei in active.values():
+                    conflicts.append((block_id, ti, tj, (max(si, sj), min(ei, ej))))
+            if ej > sj:
+                active[j] = (tj, sj, ej)
+                heapq.heappush(ends, (ej, j))
+        return conflicts
+
+    def earliest_free(self, block_id: BlockKey, start: float, duration: float, exclude: Optional[str] = None) -> float:
+        """Earliest entry at or after ``start`` that holds the block for ``duration``
+        without taking it above capacity: the reservation-table lookup behind space-time
+        routing. The answer is either ``start`` or the exit time of an indexed occupancy."""
+        tree = self._blocks.get(block_id)
+        if tree is None:
+            return start
+        capacity = max(1, self.capacities.get(block_id, 1))
+        t = start
+        if capacity == 1:
+            # entries come in start order, so the first gap long enough is the answer
+            for s, _, e, tid in tree.walk(start):
+                if e <= t or tid == exclude:
+                    continue
+                if s >= t + duration:
+                    break
+                t = e
+            return t
+        while True:
+            others = self.overlapping(block_id, t, t + duration, exclude=exclude)
+
+            def busy(x: float, skip: object = None) -> int:
+                return sum(1 for o in others if o is not skip and o[1] <= x < o[2])
+
+            # as in the detector's sweep: the entry must find room, and so must every
+            # occupancy (zero-length ones included) entering while it holds the block
+            if busy(t) < capacity and all(busy(o[1], o) < capacity - 1 for o in others if o[1] > t):
+                return t
+            # nothing inside the window leaves before the earliest exit, so jump there
+            t = min(e for _, _, e in others)
+
+    def count_conflicts(self, occupancies: List[BlockOccupancy], train_id: str = PROBE_ID) -> int:
+        return len(self.query_route(occupancies, train_id))
+
+    @staticmethod
+    def _over_capacity(
+        start: float, end: float, others: List[Tuple[str, float, float]], capacity: int
+    ) -> List[Tuple[str, float, float]]:
+        # Replay the detector's sweep on the intervals overlapping the probe: every interval
+        # active at any start inside the probe window is among them. The probe (train id None)
+        # sorts after equal starts, as it would when appended to the train list.
+        events: List[Tuple[Optional[str], float, float]] = sorted(others + [(None, start, end)], key=lambda x: x[1])
+        hits: List[Tuple[str, float, float]] = []
+        active: List[Tuple[Optional[str], float, float]] = []
+        for item in events:
+            active = [a for a in active if a[2] > item[1]]
+            if len(active) >= capacity:
+                if item[0] is None:
+                    hits.extend(a for a in active)  # type: ignore[misc]
+                elif any(a[0] is None for a in active):
+                    hits.append(item)  # type: ignore[arg-type]
+            if item[2] > item[1]:
+                active.append(item)
+        return hits
@@ -1,8 +1,22 @@
 from __future__ import annotations
 
+from array import array
+import bisect
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 from dataclasses import dataclass, field
-from typing import Dict, List, Tuple, Optional, Set
+from enum import IntEnum
+import copy
+import hashlib
+import itertools
+import json
+import math
+import operator
+import threading
+from types import MappingProxyType
+from typing import Any, Callable, Dict, Hashable, Iterable, Iterator, List, Mapping, NamedTuple, Protocol, Sequence, Tuple, Optional, Set, TextIO
 import heapq
+import zlib
 
 
 # -----------------------------
@@ -10,9 +24,13 @@ import heapq
 # -----------------------------
 
 
+# Dense int from a network's SymbolTable; hand-built demos may still use "u-v" labels
+BlockKey = Hashable
+
+
 @dataclass
 class BlockOccupancy:
-    block_id: str
+    block_id: BlockKey
     start_time: float
     end_time: float
 
@@ -27,20 +45,369 @@ class Train:
     delay_minutes: float = 0.0
 
 
-@dataclass
+@dataclass(frozen=True)
 class Edge:
     u: str
     v: str
     weight: float  # nominal travel time (minutes)
 
 
-@dataclass
+class SymbolTable:
+    """Dense integer ids for station names and blocks.
+
+    Blocks are keyed by their (from, to) station ids rather than an ``f"{u}-{v}"`` label,
+    so names containing '-' cannot collide. A single-line block is registered as shared:
+    both running directions resolve to the same id because they use the same track.
+    """
+
+    def __init__(self) -> None:
+        self.station_names: List[str] = []
+        self.station_ids: Dict[str, int] = {}
+        self.block_ends: List[Tuple[int, int]] = []
+        self.block_ids: Dict[Tuple[int, int], int] = {}
+
+    def station(self, name: str) -> int:
+        sid = self.station_ids.get(name)
+        if sid is None:
+            sid = len(self.station_names)
+            self.station_ids[name] = sid
+            self.station_names.append(name)
+        return sid
+
+    def block(self, u: str, v: str, shared: bool = False) -> int:
+        key = (self.station(u), self.station(v))
+        bid = self.block_ids.get(key)
+        if bid is None:
+            bid = len(self.block_ends)
+            self.block_ids[key] = bid
+            self.block_ends.append(key)
+        if shared:
+            self.block_ids.setdefault((key[1], key[0]), bid)
+        return bid
+
+    def find_block(self, u: str, v: str) -> Optional[int]:
+        su = self.station_ids.get(u)
+        sv = self.station_ids.get(v)
+        if su is None or sv is None:
+            return None
+        return self.block_ids.get((su, sv))
+
+    def station_name(self, sid: int) -> str:
+        return self.station_names[sid]
+
+    def block_name(self, bid: BlockKey) -> str:
+        # Human-readable "u-v" label, only for output; non-interned keys pass through
+        if not isinstance(bid, int):
+            return str(bid)
+        u, v = self.block_ends[bid]
+        return f"{self.station_names[u]}-{self.station_names[v]}"
+
+
 class RailNetwork:
-    nodes: Set[str]
-    edges: Dict[str, List[Edge]]  # adjacency: node -> list of outgoing edges
+    """Stations and directed edges, with interned block ids and per-block capacities.
+
+    ``edges`` is a read-only view (node -> tuple of outgoing edges); change the network
+    through ``add_edge``, ``close_edges``, ``slow_edges``, ``reopen_edges`` and
+    ``restore_edges``, which intern what they add and bump ``version`` so the compiled
+    form is rebuilt.
+    """
+
+    def __init__(
+        self,
+        nodes: Set[str],
+        edges: Dict[str, List[Edge]],
+        symbols: Optional[SymbolTable] = None,
+        capacities: Optional[Dict[BlockKey, int]] = None,
+    ) -> None:
+        self.nodes = set(nodes)
+        self.symbols = symbols if symbols is not None else SymbolTable()
+        self.capacities: Dict[BlockKey, int] = capacities if capacities is not None else {}  # block id -> trains allowed at once
+        self.version = 0
+        self._edges: Dict[str, Tuple[Edge, ...]] = {u: tuple(out) for u, out in edges.items()}
+        self._compiled: Optional[CompiledNetwork] = None
+        self._closed: Dict[Tuple[str, str], List[Edge]] = {}
+        # running times of slowed (u, v) edges before their first slow_edges, for restore_edges
+        self._slowed: Dict[Tuple[str, str], List[float]] = {}
+        for out in self._edges.values():
+            for e in out:
+                self.nodes.update((e.u, e.v))
+        for node in sorted(self.nodes):
+            self.symbols.station(node)
+        for out in self._edges.values():
+            for e in out:
+                self.symbols.block(e.u, e.v)
+
+    @property
+    def edges(self) -> Mapping[str, Tuple[Edge, ...]]:
+        return MappingProxyType(self._edges)
 
     def neighbors(self, node: str) -> List[Tuple[str, float]]:
-        return [(e.v, e.weight) for e in self.edges.get(node, [])]
+        return [(e.v, e.weight) for e in self._edges.get(node, ())]
+
+    def block_id(self, u: str, v: str) -> int:
+        # Lookup only: blocks are interned when edges are added, so an unknown hop
+        # (usually a misspelt station) fails instead of minting a new block
+        bid = self.symbols.find_block(u, v)
+        if bid is None:
+            raise KeyError(f"no block from {u!r} to {v!r} in this network")
+        return bid
+
+    def add_edge(self, u: str, v: str, weight: float) -> None:
+        self.nodes.update((u, v))
+        self._edges[u] = self._edges.get(u, ()) + (Edge(u, v, weight),)
+        self.symbols.station(u)
+        self.symbols.station(v)
+        self.symbols.block(u, v)
+        self.invalidate()
+
+    def invalidate(self) -> None:
+        # Forces the compiled form to be rebuilt; the edge-editing methods call it
+        self.version += 1
+
+    def close_edges(self, pairs: Iterable[Tuple[str, str]]) -> Set[BlockKey]:
+        # Take (u, v) edges out of service; they are kept aside for reopen_edges.
+        # Returns the block ids that were actually closed.
+        closed: Set[BlockKey] = set()
+        for u, v in pairs:
+            out = self._edges.get(u, ())
+            gone = [e for e in out if e.v == v]
+            if not gone:
+                continue
+            self._edges[u] = tuple(e for e in out if e.v != v)
+            self._closed.setdefault((u, v), []).extend(gone)
+            closed.add(self.block_id(u, v))
+        if closed:
+            self.invalidate()
+        return closed
+
+    def slow_edges(self, pairs: Iterable[Tuple[str, str]], factor: float) -> Set[BlockKey]:
+        # Set the running time of (u, v) edges to ``factor`` times their original one (a
+        # second call replaces the first factor rather than compounding it); returns the
+        # block ids hit. restore_edges undoes it.
+        wanted = set(pairs)
+        slowed: Set[BlockKey] = set()
+        for u, out in self._edges.items():
+            for v in {e.v for e in out if (u, e.v) in wanted}:
+                original = self._slowed.setdefault((u, v), [e.weight for e in out if e.v == v])
+                self._set_weights(u, v, [w * factor for w in original])
+                slowed.add(self.block_id(u, v))
+        if slowed:
+            self.invalidate()
+        return slowed
+
+    def restore_edges(self, pairs: Optional[Iterable[Tuple[str, str]]] = None) -> Set[BlockKey]:
+        # Give slowed edges back their original running time (all of them when ``pairs``
+        # is None), whether they are in service or closed at the moment
+        keys = list(self._slowed) if pairs is None else [p for p in pairs if p in self._slowed]
+        for u, v in keys:
+            self._set_weights(u, v, self._slowed.pop((u, v)))
+        if keys:
+            self.invalidate()
+        return {self.block_id(u, v) for u, v in keys}
+
+    def _set_weights(self, u: str, v: str, weights: List[float]) -> None:
+        # New running times for the (u, v) edges, in order, wherever they are kept
+        closed = self._closed.get((u, v))
+        if closed:
+            self._closed[(u, v)] = [Edge(e.u, e.v, w) for e, w in zip(closed, weights)] + closed[len(weights):]
+            return
+        it = iter(weights)
+        self._edges[u] = tuple(Edge(e.u, e.v, next(it, e.weight)) if e.v == v else e for e in self._edges.get(u, ()))
+
+    def reopen_edges(self, pairs: Optional[Iterable[Tuple[str, str]]] = None) -> Set[BlockKey]:
+        # Put closed edges back in service (all of them when ``pairs`` is None)
+        keys = list(self._closed) if pairs is None else [p for p in pairs if p in self._closed]
+        for key in keys:
+            self._edges[key[0]] = self._edges.get(key[0], ()) + tuple(self._closed.pop(key))
+        if keys:
+            self.invalidate()
+        return {self.block_id(u, v) for u, v in keys}
+
+    def compiled(self) -> "CompiledNetwork":
+        if self._compiled is None or self._compiled.version != self.version:
+            self._compiled = CompiledNetwork(self)
+        return self._compiled
+
+    def content_hash(self) -> str:
+        # Identifies the topology and weights, so caches survive rebuilding an identical network
+        return self.compiled().content_hash
+
+
+class CompiledNetwork:
+    """Compressed-sparse-row adjacency over interned station ids.
+
+    The outgoing edges of station ``u`` are ``targets[offsets[u]:offsets[u + 1]]`` with
+    matching ``weights``; ``edge_index`` maps a (u, v) station pair to its position in
+    those arrays. Routing runs on these flat arrays without building tuples per edge.
+    """
+
+    def __init__(self, network: RailNetwork) -> None:
+        self.version = network.version
+        self.symbols = network.symbols
+        # intern from the live nodes and edges, so stations the symbol table has not seen yet get ids
+        for node in sorted(network.nodes):
+            self.symbols.station(node)
+        for edges in network.edges.values():
+            for e in edges:
+                self.symbols.block(e.u, e.v)
+        self.num_nodes = len(self.symbols.station_names)
+        out: List[List[Edge]] = [[] for _ in range(self.num_nodes)]
+        for edges in network.edges.values():
+            for e in edges:
+                out[self.symbols.station_ids[e.u]].append(e)
+        self.offsets = array("l", [0])
+        self.targets = array("l")
+        self.weights = array("d")
+        self.edge_index: Dict[Tuple[int, int], int] = {}
+        for u, edges in enumerate(out):
+            for e in edges:
+                v = self.symbols.station_ids[e.v]
+                # parallel edges: the first one wins lookups, Dijkstra still relaxes all
+                self.edge_index.setdefault((u, v), len(self.targets))
+                self.targets.append(v)
+                self.weights.append(e.weight)
+            self.offsets.append(len(self.targets))
+        # station order is part of the hash: cached trees are indexed by station id
+        digest = hashlib.sha1(repr(self.symbols.station_names[: self.num_nodes]).encode("utf-8"))
+        for e in sorted((e.u, e.v, e.weight) for edges in network.edges.values() for e in edges):
+            digest.update(repr(e).encode("utf-8"))
+        self.content_hash = digest.hexdigest()
+        self._reverse: Optional[Tuple[array, array, array]] = None
+
+    def reverse_csr(self) -> Tuple[array, array, array]:
+        # (offsets, sources, weights) of incoming edges, built on first use
+        if self._reverse is None:
+            incoming: List[List[Tuple[int, float]]] = [[] for _ in range(self.num_nodes)]
+            for u in range(self.num_nodes):
+                for k in range(self.offsets[u], self.offsets[u + 1]):
+                    incoming[self.targets[k]].append((u, self.weights[k]))
+            offsets, sources, weights = array("l", [0]), array("l"), array("d")
+            for edges in incoming:
+                for u, w in edges:
+                    sources.append(u)
+                    weights.append(w)
+                offsets.append(len(sources))
+            self._reverse = (offsets, sources, weights)
+        return self._reverse
+
+    def node(self, name: str) -> Optional[int]:
+        sid = self.symbols.station_ids.get(name)
+        # stations interned after compilation have no edges here
+        return sid if sid is not None and sid < self.num_nodes else None
+
+    def edge_weight(self, u: str, v: str) -> Optional[float]:
+        su = self.node(u)
+        sv = self.node(v)
+        if su is None or sv is None:
+            return None
+        k = self.edge_index.get((su, sv))
+        return None if k is None else self.weights[k]
+
+
+# -----------------------------
+# Columnar occupancy store
+# -----------------------------
+
+
+class OccupancyTable:
+    """Struct-of-arrays view of every train's block occupancies.
+
+    Rows are sorted by (block, start), equal starts in train then leg order, and held in
+    typed ``array`` columns: int32 block, train and leg (position in the train's
+    occupancy list) indices and float64 start/end times, 28 bytes per occupancy
+    instead of a dataclass instance with boxed floats. ``block_offsets`` gives each
+    block's contiguous row range, so sweeps walk flat arrays instead of Python objects.
+    ``occupancies_for`` and ``apply_to`` adapt back to the ``BlockOccupancy`` API.
+    """
+
+    def __init__(self, block_names: List[BlockKey], train_names: List[str]) -> None:
+        self.block_names = block_names
+        self.train_names = train_names
+        self.block = array("i")
+        self.train = array("i")
+        self.leg = array("i")
+        self.start = array("d")
+        self.end = array("d")
+        self.block_offsets = array("l", [0])
+
+    @classmethod
+    def from_trains(cls, trains: Iterable[Train]) -> "OccupancyTable":
+        # rows bucketed per block (numbered in order of first appearance, like the
+        # detector's sweep), then a stable sort on start keeps ties in (train, leg) order
+        buckets: Dict[BlockKey, List[Tuple[float, float, int, int]]] = {}
+        names: List[str] = []
+        for ti, t in enumerate(trains):
+            names.append(t.train_id)
+            for leg, occ in enumerate(t.occupancies):
+                buckets.setdefault(occ.block_id, []).append((occ.start_time, occ.end_time, ti, leg))
+        table = cls(list(buckets), names)
+        by_start = operator.itemgetter(0)
+        for b, rows in enumerate(buckets.values()):
+            rows.sort(key=by_start)
+            starts, ends, train_ix, legs = zip(*rows)
+            table.block.extend([b] * len(rows))
+            table.start.extend(starts)
+            table.end.extend(ends)
+            table.train.extend(train_ix)
+            table.leg.extend(legs)
+            table.block_offsets.append(len(table.start))
+        return table
+
+    def __len__(self) -> int:
+        return len(self.start)
+
+    @property
+    def nbytes(self) -> int:
+        cols = (self.block, self.train, self.leg, self.start, self.end, self.block_offsets)
+        return sum(len(c) * c.itemsize for c in cols)
+
+    def block_rows(self, b: int) -> range:
+        return range(self.block_offsets[b], self.block_offsets[b + 1])
+
+    def occupancies_for(self, train: int) -> List[BlockOccupancy]:
+        rows = sorted((self.leg[r], r) for r in range(len(self)) if self.train[r] == train)
+        return [BlockOccupancy(self.block_names[self.block[r]], self.start[r], self.end[r]) for _, r in rows]
+
+    def apply_to(self, trains: List[Train]) -> None:
+        # Write the (possibly shifted) times back into the trains the table was built from
+        for r in range(len(self)):
+            occ = trains[self.train[r]].occupancies[self.leg[r]]
+            occ.start_time = self.start[r]
+            occ.end_time = self.end[r]
+
+    def detect_conflicts(
+        self, capacities: Optional[Dict[BlockKey, int]] = None
+    ) -> List[Tuple[BlockKey, str, str, Tuple[float, float]]]:
+        """The ``detect_block_conflicts`` result, computed on the columns.
+
+        Each block's rows are a contiguous, start-sorted slice, so the sweep is a single
+        pass over it; pairs come out in ``iter_block_conflicts`` order (by entering row,
+        then by the row already on the block).
+        """
+        conflicts: List[Tuple[BlockKey, str, str, Tuple[float, float]]] = []
+        names = self.train_names
+        for b, block_id in enumerate(self.block_names):
+            lo, hi = self.block_offsets[b], self.block_offsets[b + 1]
+            if hi - lo < 2:
+                continue
+            capacity = max(1, capacities.get(block_id, 1)) if capacities else 1
+            # one block's slice of the columns, unboxed once
+            start, end = self.start[lo:hi].tolist(), self.end[lo:hi].tolist()
+            train = self.train[lo:hi].tolist()
+            # rows still on the block, in row order; usually a handful, so re-filtering the
+            # list per entry is cheaper than a heap of end times
+            active: List[int] = []
+            for j, sj in enumerate(start):
+                if active:
+                    active = [i for i in active if end[i] > sj]
+                    if len(active) >= capacity:
+                        ej, tj = end[j], names[train[j]]
+                        for i in active:
+                            window = (max(start[i], sj), min(end[i], ej))
+                            conflicts.append((block_id, names[train[i]], tj, window))
+                if end[j] > sj:
+                    active.append(j)
+        return conflicts
 
 
 # -----------------------------
@@ -52,47 +419,167 @@ def intervals_overlap(a_start: float, a_end: float, b_start: float, b_end: float
     return not (a_end <= b_start or b_end <= a_start)
 
 
-def detect_block_conflicts(trains: List[Train]) -> List[Tuple[str, str, str, Tuple[float, float]]]:
-    conflicts: List[Tuple[str, str, str, Tuple[float, float]]] = []
-    # index by block_id
-    block_to_occ: Dict[str, List[Tuple[str, float, float]]] = {}
+def iter_block_conflicts(
+    trains: Iterable[Train],
+    *,
+    involving: Optional[Iterable[str]] = None,
+    blocks: Optional[Iterable[BlockKey]] = None,
+    time_window: Optional[Tuple[float, float]] = None,
+    capacities: Optional[Dict[BlockKey, int]] = None,
+) -> Iterator[Tuple[BlockKey, str, str, Tuple[float, float]]]:
+    """Lazily yield the conflicts ``detect_block_conflicts`` would report, filtered.
+
+    Sweep-line per block: occupancies are visited in start order and an active set keeps
+    the ones still on the block, expired through a heap of end times. A pair is reported
+    only when the entering train pushes the block above its capacity (default 1), so the
+    cost is O(n log n + k) instead of rescanning every later occupancy.
+
+    Filters cut the work, not just the output: ``blocks`` and ``involving`` (train ids)
+    limit which blocks are swept, and with ``involving`` a block only keeps the
+    occupancies overlapping the involved trains' own, which are all that can be active
+    when they meet. ``time_window`` (t0, t1) keeps conflicts whose overlap touches the
+    window and drops occupancies starting after it. Blocks are swept one at a time, so a
+    consumer that stops early skips the remaining blocks.
+    """
+    wanted = set(involving) if involving is not None else None
+    block_filter = set(blocks) if blocks is not None else None
+    t0, t1 = time_window if time_window is not None else (-math.inf, math.inf)
+    block_to_occ: Dict[BlockKey, List[Tuple[str, float, float]]] = {}
+    probes: Dict[BlockKey, List[Tuple[float, float]]] = {}
     for t in trains:
         for occ in t.occupancies:
+            if block_filter is not None and occ.block_id not in block_filter:
+                continue
+            if occ.start_time > t1:
+                continue
             block_to_occ.setdefault(occ.block_id, []).append((t.train_id, occ.start_time, occ.end_time))
+            if wanted is not None and t.train_id in wanted:
+                probes.setdefault(occ.block_id, []).append((occ.start_time, occ.end_time))
     for block_id, items in block_to_occ.items():
+        if wanted is not None:
+            windows = probes.get(block_id)
+            if not windows:
+                continue
+            # an occupancy matters if it is on the block at some instant of a probe window
+            # (zero-length ones if they fall inside it)
+            items = [
+                x for x in items
+                if x[0] in wanted or any(x[1] <= we and (x[2] > ws or x[1] >= ws) for ws, we in windows)
+            ]
+        capacity = max(1, capacities.get(block_id, 1)) if capacities else 1
         items.sort(key=lambda x: x[1])
-        for i in range(len(items)):
-            ti, si, ei = items[i]
-            for j in range(i + 1, len(items)):
-                tj, sj, ej = items[j]
-                if intervals_overlap(si, ei, sj, ej):
-                    conflicts.append((block_id, ti, tj, (max(si, sj), min(ei, ej))))
-                else:
-                    if sj >= ei:
-                        break
-    return conflicts
+        active: Dict[int, Tuple[str, float, float]] = {}
+        ends: List[Tuple[float, int]] = []
+        for j, (tj, sj, ej) in enumerate(items):
+            while ends and ends[0][0] <= sj:
+                _, i = heapq.heappop(ends)
+                del active[i]
+            if len(active) >= capacity:
+                for ti, si, ei in list(active.values()):
+                    window = (max(si, sj), min(ei, ej))
+                    if wanted is not None and ti not in wanted and tj not in wanted:
+                        continue
+                    if window[0] <= t1 and window[1] >= t0:
+                        yield (block_id, ti, tj, window)
+            if ej > sj:
+                active[j] = (tj, sj, ej)
+                heapq.heappush(ends, (ej, j))
 
 
-def detect_node_edge_contention(trains: List[Train]) -> List[Tuple[str, str, str, float]]:
-    # Simple event-based contention on nodes: for each node visit time, ensure only one arrival
-    # Here we approximate with occupancy endpoints as node events
-    events: Dict[str, List[Tuple[float, str, str]]] = {}
-    for t in trains:
-        for occ in t.occupancies:
-            events.setdefault(occ.block_id, []).append((occ.start_time, t.train_id, "enter"))
-            events.setdefault(occ.block_id, []).append((occ.end_time, t.train_id, "exit"))
-    contentions: List[Tuple[str, str, str, float]] = []
-    for block_id, evs in events.items():
-        evs.sort()
-        active: Set[str] = set()
-        for ts, train_id, kind in evs:
+def has_conflict(trains: Iterable[Train], **filters) -> bool:
+    # Stops at the first conflict; accepts the iter_block_conflicts filters
+    return next(iter_block_conflicts(trains, **filters), None) is not None
+
+
+def detect_block_conflicts(
+    trains: List[Train], capacities: Optional[Dict[BlockKey, int]] = None
+) -> List[Tuple[BlockKey, str, str, Tuple[float, float]]]:
+    # Every conflict, swept on the columnar store; iter_block_conflicts is the lazy,
+    # filterable form with the same output order
+    return OccupancyTable.from_trains(trains).detect_conflicts(capacities)
+
+
+@dataclass
+class BlockProfile:
+    """Concurrent-occupancy step function of one block.
+
+    ``counts[i]`` trains are on the block during ``[times[i], times[i + 1])``; the last
+    count is 0. Occupancies are half-open, so a train leaving as another enters does
+    not overlap it. Pairwise contention is only expanded on demand by ``pairs()``.
+    """
+
+    block_id: BlockKey
+    capacity: int
+    times: List[float] = field(default_factory=list)
+    counts: List[int] = field(default_factory=list)
+    peak: int = 0
+    over_capacity: List[Tuple[float, float]] = field(default_factory=list)  # count > capacity
+    _events: List[Tuple[float, str, str]] = field(default_factory=list, repr=False)
+
+    @property
+    def over_capacity_min(self) -> float:
+        return sum(e - s for s, e in self.over_capacity)
+
+    def count_at(self, t: float) -> int:
+        i = bisect.bisect_right(self.times, t) - 1
+        return self.counts[i] if i >= 0 else 0
+
+    def pairs(self) -> Iterator[Tuple[BlockKey, str, str, float]]:
+        # (block, entering train, train already on the block, entry time), lazily
+        self._events.sort()
+        active: Dict[str, None] = {}
+        for ts, train_id, kind in self._events:
             if kind == "enter":
                 for other in active:
-                    contentions.append((block_id, train_id, other, ts))
-                active.add(train_id)
+                    yield (self.block_id, train_id, other, ts)
+                active[train_id] = None
             else:
-                active.discard(train_id)
-    return contentions
+                active.pop(train_id, None)
+
+
+def contention_profile(
+    trains: List[Train], capacities: Optional[Dict[BlockKey, int]] = None
+) -> Dict[BlockKey, BlockProfile]:
+    # One sorted sweep of +1/-1 events per block; exits sort before entries at equal times.
+    # Cost is O(n log n) whatever the number of simultaneous trains.
+    events: Dict[BlockKey, List[Tuple[float, int, str]]] = {}
+    for t in trains:
+        for occ in t.occupancies:
+            evs = events.setdefault(occ.block_id, [])
+            evs.append((occ.start_time, 1, t.train_id))
+            evs.append((occ.end_time, -1, t.train_id))
+    profiles: Dict[BlockKey, BlockProfile] = {}
+    for block_id, evs in events.items():
+        capacity = max(1, capacities.get(block_id, 1)) if capacities else 1
+        profile = BlockProfile(block_id, capacity)
+        profile._events = [(ts, tid, "enter" if d > 0 else "exit") for ts, d, tid in evs]
+        evs.sort(key=lambda x: (x[0], x[1]))
+        count = 0
+        over_since: Optional[float] = None
+        i = 0
+        while i < len(evs):
+            ts = evs[i][0]
+            while i < len(evs) and evs[i][0] == ts:
+                count += evs[i][1]
+                i += 1
+            if profile.times and profile.counts[-1] == count:
+                continue  # zero-length occupancy, no visible step
+            profile.times.append(ts)
+            profile.counts.append(count)
+            profile.peak = max(profile.peak, count)
+            if count > capacity and over_since is None:
+                over_since = ts
+            elif count <= capacity and over_since is not None:
+                profile.over_capacity.append((over_since, ts))
+                over_since = None
+        profiles[block_id] = profile
+    return profiles
+
+
+def detect_node_edge_contention(trains: List[Train]) -> List[Tuple[BlockKey, str, str, float]]:
+    # Every (block, entering, present, time) pair; O(k^2) per crowded block by nature,
+    # prefer contention_profile when counts or over-capacity intervals are enough
+    return [c for profile in contention_profile(trains).values() for c in profile.pairs()]
 
 
 # -----------------------------
@@ -104,20 +591,85 @@ def compute_priority_score(train: Train, delay_factor: float = 0.1) -> float:
     return train.priority * (1.0 + delay_factor * max(0.0, train.delay_minutes))
 
 
-def decide_precedence(conflict_pairs: List[Tuple[str, str]], trains_by_id: Dict[str, Train]) -> Dict[str, str]:
-    # returns mapping train_id -> action {"PROCEED", "HOLD"}
-    decisions: Dict[str, str] = {}
+def precedence_rank(train: Train) -> Tuple[float, int, str]:
+    # Sort key: higher priority score first, then higher nominal priority, then train id
+    return (-compute_priority_score(train), -train.priority, train.train_id)
+
+
+def conflict_components(conflict_pairs: List[Tuple[str, str]]) -> List[List[str]]:
+    # Connected components of the conflict graph via union-find with path halving
+    parent: Dict[str, str] = {}
+
+    def find(x: str) -> str:
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
     for a, b in conflict_pairs:
-        ta = trains_by_id[a]
-        tb = trains_by_id[b]
-        sa = compute_priority_score(ta)
-        sb = compute_priority_score(tb)
-        if sa >= sb:
-            decisions.setdefault(a, "PROCEED")
-            decisions.setdefault(b, "HOLD")
+        parent.setdefault(a, a)
+        parent.setdefault(b, b)
+        ra, rb = find(a), find(b)
+        if ra != rb:
+            parent[max(ra, rb)] = min(ra, rb)
+    groups: Dict[str, List[str]] = {}
+    for x in parent:
+        groups.setdefault(find(x), []).append(x)
+    return list(groups.values())
+
+
+def solve_component(ranked: List[str], adjacency: Dict[str, Set[str]]) -> List[Tuple[str, str]]:
+    # Precedence for one connected component of the conflict graph, its trains given in
+    # precedence_rank order. Walk the component in rank order: a train proceeds unless it conflicts with a train
+    # already proceeding, so every HOLD is justified by a higher-ranked conflicting train
+    proceeding: Set[str] = set()
+    out: List[Tuple[str, str]] = []
+    for tid in ranked:
+        if adjacency[tid].isdisjoint(proceeding):
+            proceeding.add(tid)
+            out.append((tid, "PROCEED"))
         else:
-            decisions.setdefault(b, "PROCEED")
-            decisions.setdefault(a, "HOLD")
+            out.append((tid, "HOLD"))
+    return out
+
+
+def decide_precedence(
+    conflict_pairs: List[Tuple[str, str]],
+    trains_by_id: Dict[str, Train],
+    workers: int = 0,
+    committed: Iterable[str] = (),
+) -> Dict[str, str]:
+    # returns mapping train_id -> action {"PROCEED", "HOLD"}
+    # The conflict graph is split into connected components, each solved independently in
+    # precedence_rank order, so the answer no longer depends on the order of the pairs.
+    # Trains in ``committed`` (already on a contested block, so they cannot be held back)
+    # rank ahead of all others. With workers > 1 the components are spread over a process pool.
+    first = set(committed)
+
+    def rank(tid: str) -> Tuple[bool, Tuple[float, int, str]]:
+        return (tid not in first, precedence_rank(trains_by_id[tid]))
+
+    adjacency: Dict[str, Set[str]] = {}
+    for a, b in conflict_pairs:
+        if a == b:
+            continue
+        adjacency.setdefault(a, set()).add(b)
+        adjacency.setdefault(b, set()).add(a)
+    tasks: List[Tuple[List[str], Dict[str, Set[str]]]] = []
+    for members in conflict_components([(a, b) for a, b in conflict_pairs if a != b]):
+        ranked = sorted(members, key=rank)
+        tasks.append((ranked, {tid: adjacency[tid] for tid in ranked}))
+    # components in the order of their best-ranked train, for reproducible output
+    tasks.sort(key=lambda task: rank(task[0][0]))
+    if workers > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            chunk = max(1, len(tasks) // (workers * 4))
+            results = list(pool.map(solve_component, *zip(*tasks), chunksize=chunk))
+    else:
+        results = [solve_component(ranked, adj) for ranked, adj in tasks]
+    decisions: Dict[str, str] = {}
+    for result in results:
+        decisions.update(result)
     return decisions
 
 
@@ -126,34 +678,277 @@ def decide_precedence(conflict_pairs: List[Tuple[str, str]], trains_by_id: Dict[
 # -----------------------------
 
 
-def dijkstra_shortest_path(network: RailNetwork, start: str, goal: str) -> Optional[Tuple[float, List[str]]]:
-    pq: List[Tuple[float, str]] = [(0.0, start)]
-    dist: Dict[str, float] = {start: 0.0}
-    prev: Dict[str, Optional[str]] = {start: None}
-    visited: Set[str] = set()
+def _dijkstra(g: CompiledNetwork, source: int, target: int = -1, reverse: bool = False) -> Tuple[List[float], List[int]]:
+    # Distances and predecessors from source; stops early once target is settled.
+    # With reverse=True edges are followed backwards: distances are *to* source and
+    # prev[u] is the next hop from u towards it.
+    offsets, targets, weights = g.reverse_csr() if reverse else (g.offsets, g.targets, g.weights)
+    dist = [float("inf")] * g.num_nodes
+    prev = [-1] * g.num_nodes
+    dist[source] = 0.0
+    pq: List[Tuple[float, int]] = [(0.0, source)]
     while pq:
         d, u = heapq.heappop(pq)
-        if u in visited:
+        if d > dist[u]:
             continue
-        visited.add(u)
-        if u == goal:
+        if u == target:
             break
-        for v, w in network.neighbors(u):
-            nd = d + w
-            if nd < dist.get(v, float("inf")):
+        for k in range(offsets[u], offsets[u + 1]):
+            v = targets[k]
+            nd = d + weights[k]
+            if nd < dist[v]:
                 dist[v] = nd
                 prev[v] = u
                 heapq.heappush(pq, (nd, v))
-    if goal not in dist:
-        return None
-    # reconstruct path
+    return dist, prev
+
+
+def _tree_path(g: CompiledNetwork, prev: List[int], target: int) -> List[str]:
+    names = g.symbols.station_names
     path: List[str] = []
-    cur: Optional[str] = goal
-    while cur is not None:
-        path.append(cur)
-        cur = prev.get(cur)
+    cur = target
+    while cur != -1:
+        path.append(names[cur])
+        cur = prev[cur]
     path.reverse()
-    return dist[goal], path
+    return path
+
+
+def dijkstra_shortest_path(network: RailNetwork, start: str, goal: str) -> Optional[Tuple[float, List[str]]]:
+    if start == goal:
+        return 0.0, [start]
+    g = network.compiled()
+    s = g.node(start)
+    t = g.node(goal)
+    if s is None or t is None:
+        return None
+    dist, prev = _dijkstra(g, s, t)
+    if dist[t] == float("inf"):
+        return None
+    return dist[t], _tree_path(g, prev, t)
+
+
+def shortest_path_tree(network: RailNetwork, start: str) -> Optional[Tuple[List[float], List[int]]]:
+    # One-to-many search: a single run answers every destination from ``start``
+    g = network.compiled()
+    s = g.node(start)
+    if s is None:
+        return None
+    return _dijkstra(g, s)
+
+
+def reverse_shortest_path_tree(network: RailNetwork, goal: str) -> Optional[Tuple[List[float], List[int]]]:
+    # Many-to-one search: distance from every station to ``goal`` and the next hop towards it
+    g = network.compiled()
+    t = g.node(goal)
+    if t is None:
+        return None
+    return _dijkstra(g, t, reverse=True)
+
+
+def _spur_path(
+    g: CompiledNetwork, source: int, target: int, banned: Set[int], banned_first: Set[int], lower: List[float], nxt: List[int]
+) -> Optional[Tuple[float, List[int]]]:
+    # Shortest source -> target path avoiding ``banned`` stations and the first hops in
+    # ``banned_first``. No path can beat the best allowed first hop plus its tree distance,
+    # so when that hop's tree path is clear it is the answer; otherwise A* runs with the
+    # tree distances as the heuristic.
+    offsets, targets, weights = g.offsets, g.targets, g.weights
+    best, first = float("inf"), -1
+    for k in range(offsets[source], offsets[source + 1]):
+        v = targets[k]
+        if v not in banned and v not in banned_first and weights[k] + lower[v] < best:
+            best, first = weights[k] + lower[v], v
+    if first == -1 or best == float("inf"):
+        return None
+    path = [source, first]
+    while path[-1] != target and path[-1] not in banned and path[-1] != source:
+        path.append(nxt[path[-1]])
+    if path[-1] == target and not banned.intersection(path) and source not in path[1:]:
+        return best, path
+    dist: Dict[int, float] = {source: 0.0}
+    prev: Dict[int, int] = {}
+    pq: List[Tuple[float, float, int]] = [(lower[source], 0.0, source)]
+    while pq:
+        _, d, u = heapq.heappop(pq)
+        if d > dist[u]:
+            continue
+        if u == target:
+            path = [u]
+            while u != source:
+                u = prev[u]
+                path.append(u)
+            path.reverse()
+            return d, path
+        for k in range(offsets[u], offsets[u + 1]):
+            v = targets[k]
+            if v in banned or lower[v] == float("inf") or (u == source and v in banned_first):
+                continue
+            nd = d + weights[k]
+            if nd < dist.get(v, float("inf")):
+                dist[v] = nd
+                prev[v] = u
+                heapq.heappush(pq, (nd + lower[v], nd, v))
+    return None
+
+
+def k_shortest_paths(
+    network: RailNetwork, origin: str, goal: str, k: int, tree: Optional[Tuple[List[float], List[int]]] = None
+) -> List[Tuple[float, List[str]]]:
+    """Up to ``k`` loopless origin -> goal paths in order of length (Yen's algorithm).
+
+    With Lawler's refinement each new path only spurs from its deviation node onwards,
+    since spurs before it were already generated from its parent. Every spur search
+    shares one reverse shortest-path tree to the goal (pass ``tree`` to share it across
+    origins): it answers a spur outright when the tree path is not blocked and is an
+    admissible A* heuristic when it is.
+    """
+    g = network.compiled()
+    s, t = g.node(origin), g.node(goal)
+    if k <= 0 or s is None or t is None:
+        return []
+    if s == t:
+        return [(0.0, [origin])]
+    lower, nxt = tree if tree is not None else _dijkstra(g, t, reverse=True)
+    if lower[s] == float("inf"):
+        return []
+
+    def hop(u: int, v: int) -> float:
+        # parallel edges: searches take the cheapest
+        return min(g.weights[j] for j in range(g.offsets[u], g.offsets[u + 1]) if g.targets[j] == v)
+
+    first = _spur_path(g, s, t, set(), set(), lower, nxt)
+    found: List[Tuple[float, List[int], int]] = [(first[0], first[1], 0)]  # (cost, path, deviation index)
+    candidates: List[Tuple[float, List[int], int]] = []
+    seen = {tuple(first[1])}
+    while len(found) < k:
+        _, last, dev = found[-1]
+        root_cost = sum(hop(last[i], last[i + 1]) for i in range(dev))
+        for j in range(dev, len(last) - 1):
+            root = last[: j + 1]
+            banned_first = {p[j + 1] for _, p, _ in found if len(p) > j + 1 and p[: j + 1] == root}
+            spur = _spur_path(g, last[j], t, set(root[:-1]), banned_first, lower, nxt)
+            if spur is not None:
+                path = root[:-1] + spur[1]
+                if tuple(path) not in seen:
+                    seen.add(tuple(path))
+                    heapq.heappush(candidates, (root_cost + spur[0], path, j))
+            root_cost += hop(last[j], last[j + 1])
+        if not candidates:
+            break
+        found.append(heapq.heappop(candidates))
+    names = g.symbols.station_names
+    return [(cost, [names[u] for u in path]) for cost, path, _ in found]
+
+
+class RouteCache:
+    """Bounded LRU of shortest paths keyed by (network content hash, origin, destination).
+
+    Misses are filled from a one-to-many shortest-path tree per origin (itself kept in a
+    smaller LRU), so trains sharing an origin cost one Dijkstra run between them. Keys
+    carry the network content hash, so a changed section set never hits stale entries;
+    ``clear()`` drops everything eagerly.
+    """
+
+    def __init__(self, maxsize: int = 4096, max_trees: int = 256) -> None:
+        self.maxsize = maxsize
+        self.max_trees = max_trees
+        self._paths: "OrderedDict[Tuple[str, str, str], Optional[Tuple[float, List[str]]]]" = OrderedDict()
+        self._trees: "OrderedDict[Tuple[str, str], Tuple[List[float], List[int]]]" = OrderedDict()
+        # k-shortest lists: (hash, origin, destination) -> (k asked for, paths found)
+        self._alternatives: "OrderedDict[Tuple[str, str, str], Tuple[int, List[Tuple[float, List[str]]]]]" = OrderedDict()
+        self._reverse: "OrderedDict[Tuple[str, str], Tuple[List[float], List[int]]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        # one cache serves every request thread; the LRU bookkeeping is not thread-safe on its own
+        self._lock = threading.Lock()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._paths.clear()
+            self._trees.clear()
+            self._alternatives.clear()
+            self._reverse.clear()
+
+    def alternatives(self, network: RailNetwork, origin: str, destination: str, k: int) -> List[Tuple[float, List[str]]]:
+        # Up to k loopless paths, shortest first; a cached longer list answers smaller k
+        key = (network.content_hash(), origin, destination)
+        with self._lock:
+            return self._alternatives_locked(network, key, k)
+
+    def _alternatives_locked(
+        self, network: RailNetwork, key: Tuple[str, str, str], k: int
+    ) -> List[Tuple[float, List[str]]]:
+        origin, destination = key[1], key[2]
+        entry = self._alternatives.get(key)
+        if entry is not None and (entry[0] >= k or len(entry[1]) < entry[0]):
+            self.hits += 1
+            self._alternatives.move_to_end(key)
+            return [(cost, list(path)) for cost, path in entry[1][:k]]
+        self.misses += 1
+        tree_key = (key[0], destination)
+        tree = self._reverse.get(tree_key)
+        if tree is None:
+            tree = reverse_shortest_path_tree(network, destination)
+            if tree is None:
+                return []
+            self._reverse[tree_key] = tree
+            if len(self._reverse) > self.max_trees:
+                self._reverse.popitem(last=False)
+        else:
+            self._reverse.move_to_end(tree_key)
+        paths = k_shortest_paths(network, origin, destination, k, tree)
+        self._alternatives[key] = (k, paths)
+        if len(self._alternatives) > self.maxsize:
+            self._alternatives.popitem(last=False)
+        return [(cost, list(path)) for cost, path in paths]
+
+    def get(self, network: RailNetwork, origin: str, destination: str) -> Optional[Tuple[float, List[str]]]:
+        key = (network.content_hash(), origin, destination)
+        with self._lock:
+            return self._get_locked(network, key)
+
+    def _get_locked(
+        self, network: RailNetwork, key: Tuple[str, str, str]
+    ) -> Optional[Tuple[float, List[str]]]:
+        origin, destination = key[1], key[2]
+        if key in self._paths:
+            self.hits += 1
+            self._paths.move_to_end(key)
+            return self._paths[key]
+        self.misses += 1
+        result = self._compute(network, key[0], origin, destination)
+        self._paths[key] = result
+        if len(self._paths) > self.maxsize:
+            self._paths.popitem(last=False)
+        return result
+
+    def path(self, network: RailNetwork, origin: str, destination: str) -> List[str]:
+        result = self.get(network, origin, destination)
+        return list(result[1]) if result else []
+
+    def _compute(
+        self, network: RailNetwork, net_hash: str, origin: str, destination: str
+    ) -> Optional[Tuple[float, List[str]]]:
+        if origin == destination:
+            return 0.0, [origin]
+        g = network.compiled()
+        t = g.node(destination)
+        if t is None or g.node(origin) is None:
+            return None
+        tree_key = (net_hash, origin)
+        tree = self._trees.get(tree_key)
+        if tree is None:
+            tree = shortest_path_tree(network, origin)
+            self._trees[tree_key] = tree
+            if len(self._trees) > self.max_trees:
+                self._trees.popitem(last=False)
+        else:
+            self._trees.move_to_end(tree_key)
+        dist, prev = tree
+        if dist[t] == float("inf"):
+            return None
+        return dist[t], _tree_path(g, prev, t)
 
 
 def reroute_if_needed(train: Train, network: RailNetwork, current_node: str, goal_node: str) -> Optional[List[str]]:
@@ -164,40 +959,440 @@ def reroute_if_needed(train: Train, network: RailNetwork, current_node: str, goa
     return path
 
 
+@dataclass
+class RerouteResult:
+    routes: Dict[str, List[str]] = field(default_factory=dict)  # full new planned path per rerouted train
+    occupancies: Dict[str, List[BlockOccupancy]] = field(default_factory=dict)
+    arrival_change: Dict[str, float] = field(default_factory=dict)  # minutes, new minus old arrival
+    stranded: List[str] = field(default_factory=list)  # affected trains with no way to their destination
+    searches: int = 0  # Dijkstra runs, one per distinct destination
+
+
+def reroute_trains(
+    trains: Iterable[Train],
+    network: RailNetwork,
+    blocks: Iterable[BlockKey],
+    now: float = 0.0,
+    apply: bool = False,
+) -> RerouteResult:
+    """Reroute every train whose remaining path uses one of ``blocks``.
+
+    Meant to follow ``close_edges``/``slow_edges``. A train already inside a block finishes
+    it and turns at its far end; a train not yet departed starts over from its origin.
+    Affected trains are grouped by destination and each group shares one reverse
+    shortest-path tree, so the batch costs one Dijkstra run per destination however many
+    trains it holds. New legs run back to back at the network's current edge weights;
+    re-run headway and conflict checks on the result. With apply=True the trains take
+    the new paths and occupancies.
+    """
+    hit = set(blocks)
+    result = RerouteResult()
+    g = network.compiled()
+    # train -> (turn index on its path, time it reaches that station)
+    groups: Dict[str, List[Tuple[Train, int, float]]] = {}
+    for t in trains:
+        occ = t.occupancies
+        if not occ or len(t.planned_path) != len(occ) + 1:
+            continue
+        k = bisect.bisect_right([o.end_time for o in occ], now)
+        if k == len(occ):
+            continue  # already arrived
+        if occ[k].start_time < now:
+            k += 1  # in the block now: finish it first
+        if not any(o.block_id in hit for o in occ[k:]):
+            continue
+        ready = occ[k - 1].end_time if k else occ[0].start_time
+        groups.setdefault(t.planned_path[-1], []).append((t, k, ready))
+    for goal, members in groups.items():
+        tree = reverse_shortest_path_tree(network, goal)
+        result.searches += 1
+        for t, k, ready in members:
+            s = g.node(t.planned_path[k])
+            if tree is None or s is None or tree[0][s] == float("inf"):
+                result.stranded.append(t.train_id)
+                continue
+            tail = _tree_path(g, tree[1], s)[::-1]
+            path = t.planned_path[:k] + tail
+            occupancies = list(t.occupancies[:k])
+            clock = ready
+            for u, v in zip(tail, tail[1:]):
+                w = g.edge_weight(u, v)
+                occupancies.append(BlockOccupancy(network.block_id(u, v), clock, clock + w))
+                clock += w
+            result.routes[t.train_id] = path
+            result.occupancies[t.train_id] = occupancies
+            result.arrival_change[t.train_id] = clock - t.occupancies[-1].end_time
+            if apply:
+                t.planned_path = path
+                t.occupancies = occupancies
+    return result
+
+
 # -----------------------------
 # Delay and ETA estimation
 # -----------------------------
 
 
 def estimate_eta_minutes(path: List[str], network: RailNetwork, start_time: float, base_delay: float = 0.0) -> float:
+    g = network.compiled()
     total = base_delay
     for i in range(len(path) - 1):
-        u = path[i]
-        v = path[i + 1]
-        # find edge weight
-        w = None
-        for e in network.edges.get(u, []):
-            if e.v == v:
-                w = e.weight
-                break
+        w = g.edge_weight(path[i], path[i + 1])
         if w is None:
             return float("inf")
         total += w
     return start_time + total
 
 
-def propagate_delay_simple(trains: List[Train], added_delay_per_conflict: float = 2.0) -> None:
-    # Simple heuristic: each conflict adds delay to HOLD trains
-    id_to_train: Dict[str, Train] = {t.train_id: t for t in trains}
-    pairs: List[Tuple[str, str, str, Tuple[float, float]]] = detect_block_conflicts(trains)
-    unique_pairs: Set[Tuple[str, str]] = set()
-    for _, a, b, _ in pairs:
-        key = tuple(sorted((a, b)))
-        unique_pairs.add(key)
-    decisions = decide_precedence(list(unique_pairs), id_to_train)
-    for tid, action in decisions.items():
-        if action == "HOLD":
-            id_to_train[tid].delay_minutes += added_delay_per_conflict
+class DelayGraph:
+    """Delay propagation over a DAG of occupancy entries.
+
+    Each occupancy is a node whose start is bounded below by its planned start (plus
+    any reported delay) and by its in-edges:
+      - within a train, a leg starts no earlier than the previous leg's start plus the
+        planned difference between the two (so lateness carries forward, slack is kept);
+      - on a block, occupancies are ordered and each one's entry is gated by the exit of
+        the one ``capacity`` places ahead.
+    Block order is planned start, except that an occupancy goes ahead of the overlapping
+    ones it takes precedence over: PROCEED before HOLD when ``decisions`` (from
+    ``decide_precedence``) are given, then ``precedence_rank``. An occupancy that entered
+    before ``now`` is never overtaken. Starts are the longest-path fixed point, computed
+    in a topological order of the edges, which resolves planned conflicts and cascades
+    knock-on delays to any depth. ``report_delay`` re-propagates only from the reported
+    node through the successors whose start actually moves; ``shifted_delays`` answers
+    "what if these trains ran late" the same way, without modifying the graph.
+    """
+
+    def __init__(
+        self,
+        trains: List[Train],
+        capacities: Optional[Dict[BlockKey, int]] = None,
+        decisions: Optional[Dict[str, str]] = None,
+        now: float = -math.inf,
+    ) -> None:
+        self.trains = {t.train_id: t for t in trains}
+        self.capacities = capacities
+        self.decisions = dict(decisions or {})
+        self.now = now
+        self.base_delay = {t.train_id: t.delay_minutes for t in trains}
+        self.keys: List[Tuple[float, Tuple[float, int, str], int]] = []
+        self.planned: List[float] = []
+        self.run: List[float] = []
+        self.floor: List[float] = []
+        self.node_of: Dict[Tuple[str, int], int] = {}
+        self.legs: Dict[str, List[int]] = {}
+        self.preds: List[List[Tuple[int, float]]] = []  # (node, offset): start >= start[node] + offset
+        self.succs: List[List[int]] = []
+        self.log: List[Tuple[str, int, float]] = []  # delay reports in arrival order
+        self.train_of: List[str] = []
+        self.block_of: List[BlockKey] = []
+        # per-node precedence on a shared block: lower goes first
+        prec = {t.train_id: (self.decisions.get(t.train_id) == "HOLD", precedence_rank(t)) for t in trains}
+        self.owner: List[Tuple[bool, Tuple[float, int, str]]] = []
+        self.blocks: Dict[BlockKey, List[int]] = {}  # nodes per block, in planned order
+        self.order: Dict[BlockKey, List[int]] = {}  # nodes per block, in the order entered
+        for t in trains:
+            rank = precedence_rank(t)
+            nodes: List[int] = []
+            for k, occ in enumerate(t.occupancies):
+                n = len(self.keys)
+                self.keys.append((occ.start_time, rank, k))
+                self.planned.append(occ.start_time)
+                self.run.append(occ.end_time - occ.start_time)
+                self.floor.append(occ.start_time)
+                self.preds.append([])
+                self.succs.append([])
+                self.owner.append(prec[t.train_id])
+                self.train_of.append(t.train_id)
+                self.block_of.append(occ.block_id)
+                self.node_of[(t.train_id, k)] = n
+                self.blocks.setdefault(occ.block_id, []).append(n)
+                if nodes:
+                    p = nodes[-1]
+                    self._edge(p, n, occ.start_time - self.planned[p])
+                nodes.append(n)
+            self.legs[t.train_id] = nodes
+        self.train_edges = [list(p) for p in self.preds]
+        self.topo: List[int] = []
+        self.reordered = False  # whether block order follows precedence (no cycle fallback)
+        for reorder in (True, False):
+            for block_id, nodes in self.blocks.items():
+                nodes.sort(key=lambda n: self.keys[n])
+                if reorder:
+                    order = self._block_order(nodes, [self.planned[n] for n in nodes], [self.owner[n] for n in nodes])
+                else:
+                    order = nodes
+                self.order[block_id] = order
+                capacity = self._capacity(block_id)
+                for i in range(capacity, len(order)):
+                    p = order[i - capacity]
+                    self._edge(p, order[i], self.run[p])
+            # topological order, planned order among the ready nodes
+            topo = self._topological()
+            if topo is not None:
+                self.topo, self.reordered = topo, reorder
+                break
+            # precedence swaps on different blocks closed a cycle: fall back to planned order
+            self.preds = [list(p) for p in self.train_edges]
+            self.succs = [[] for _ in self.keys]
+            for n, ps in enumerate(self.train_edges):
+                for p, _ in ps:
+                    self.succs[p].append(n)
+        else:
+            # only legs listed out of time order get here: keep the planned order
+            by_key = sorted(range(len(self.keys)), key=self.keys.__getitem__)
+            self.topo = [0] * len(self.keys)
+            for i, n in enumerate(by_key):
+                self.topo[n] = i
+        self.start: List[float] = list(self.floor)
+        for n in sorted(range(len(self.keys)), key=self.topo.__getitem__):
+            self.start[n] = self._bound(n)
+
+    def _capacity(self, block_id: BlockKey) -> int:
+        return max(1, self.capacities.get(block_id, 1)) if self.capacities else 1
+
+    def _block_order(
+        self,
+        nodes: List[int],
+        starts: List[float],
+        owners: List[Tuple[bool, Tuple[float, int, str]]],
+        done: Sequence[int] = (),
+    ) -> List[int]:
+        # Nodes of one block in planned order (``starts`` and ``owners`` give each one's
+        # planned start and precedence), each moved ahead of the overlapping ones it takes
+        # precedence over, and of any lower-precedence ones queued between them. It never
+        # passes a node with precedence over it, nor one that entered before ``now`` (a
+        # held train planned to enter before ``now`` is still waiting, so it can be
+        # passed). reach[i] is the latest planned end among order[:i + 1]: the walk back
+        # stops once nothing further ahead can overlap the node. Insertions never reorder
+        # the nodes already placed, so ``done``, the order of a prefix of ``nodes`` from an
+        # earlier run, resumes from there.
+        ends = [s + self.run[n] for n, s in zip(nodes, starts)]
+        index = {n: j for j, n in enumerate(nodes[: len(done)])}
+        order = [index[n] for n in done]  # positions in ``nodes``
+        reach = list(itertools.accumulate((ends[j] for j in order), max))
+        for j in range(len(done), len(nodes)):
+            start = starts[j]
+            pos = i = len(order)
+            while i and reach[i - 1] > start:
+                p = order[i - 1]
+                if owners[j] >= owners[p] or (starts[p] < self.now and not owners[p][0]):
+                    break
+                if ends[p] > start:
+                    pos = i - 1
+                i -= 1
+            order.insert(pos, j)
+            end = ends[j]
+            reach.insert(pos, max(reach[pos - 1], end) if pos else end)
+            for k in range(pos + 1, len(reach)):
+                if reach[k] >= end:
+                    break
+                reach[k] = end
+        return [nodes[j] for j in order]
+
+    def _topological(self) -> Optional[List[int]]:
+        # Position of each node in a topological order (Kahn's algorithm, ready nodes taken
+        # by planned key), or None if the edges contain a cycle
+        indegree = [len(p) for p in self.preds]
+        ready = [(self.keys[n], n) for n, d in enumerate(indegree) if d == 0]
+        heapq.heapify(ready)
+        topo = [0] * len(self.keys)
+        i = 0
+        while ready:
+            _, n = heapq.heappop(ready)
+            topo[n] = i
+            i += 1
+            for q in self.succs[n]:
+                indegree[q] -= 1
+                if indegree[q] == 0:
+                    heapq.heappush(ready, (self.keys[q], q))
+        return topo if i == len(self.keys) else None
+
+    def _edge(self, p: int, n: int, offset: float) -> None:
+        self.preds[n].append((p, offset))
+        self.succs[p].append(n)
+
+    def _bound(self, n: int) -> float:
+        start = self.floor[n]
+        for p, offset in self.preds[n]:
+            start = max(start, self.start[p] + offset)
+        return start
+
+    def report_delay(self, train_id: str, delay: float, leg: int = 0, record: bool = True) -> int:
+        # The train is now ``delay`` minutes late entering the given leg (latest report wins).
+        # Returns how many nodes were re-evaluated, i.e. the size of the affected cone.
+        # record=False keeps the report out of the log, for probes that are undone later.
+        n = self.node_of[(train_id, leg)]
+        if record:
+            self.log.append((train_id, leg, delay))
+        self.floor[n] = self.planned[n] + delay
+        heap = [(self.topo[n], n)]
+        queued = {n}
+        visited = 0
+        while heap:
+            _, m = heapq.heappop(heap)
+            visited += 1
+            start = self._bound(m)
+            if start == self.start[m] and m != n:
+                continue
+            self.start[m] = start
+            for q in self.succs[m]:
+                if q not in queued:
+                    queued.add(q)
+                    heapq.heappush(heap, (self.topo[q], q))
+        return visited
+
+    def shifted_delays(self, shifts: Dict[str, float], decisions: Optional[Dict[str, str]] = None) -> Dict[str, float]:
+        # Arrival delays with each train in ``shifts`` running that many minutes late from
+        # its first block, under ``decisions`` in place of the graph's own, counted from the
+        # unshifted plan. The graph is left as it is: moved starts, floors and edges live in
+        # copy-on-write overlays, only the blocks of the shifted or re-decided trains are
+        # re-ordered, and propagation starts from their nodes. Delay reports in the log
+        # stay in force. A graph that fell back to planned order, or a re-ordering that
+        # closes a cycle, is answered by a fresh graph instead.
+        new = self.decisions if decisions is None else decisions
+        shifts = {tid: d for tid, d in shifts.items() if tid in self.legs}
+        changed = set(shifts) | {
+            tid for tid in self.decisions.keys() | new.keys()
+            if tid in self.legs and (self.decisions.get(tid) == "HOLD") != (new.get(tid) == "HOLD")
+        }
+        if not self.reordered:
+            return self._rebuilt_delays(shifts, new)
+        # copy-on-write overlays: node -> value where it differs from the base lists
+        planned: Dict[int, float] = {}
+        floor: Dict[int, float] = {}
+        owner: Dict[int, Tuple[bool, Tuple[float, int, str]]] = {}
+        reported = {self.node_of[(tid, leg)]: delay for tid, leg, delay in self.log}
+        blocks: Dict[BlockKey, None] = {}
+        for tid in changed:
+            held = new.get(tid) == "HOLD"
+            for n in self.legs[tid]:
+                if tid in shifts:
+                    planned[n] = self.planned[n] + shifts[tid]
+                    floor[n] = planned[n] + reported.get(n, 0.0)
+                owner[n] = (held, self.owner[n][1])
+                blocks[self.block_of[n]] = None
+        # re-order each touched block from its first changed node on, then replace the block
+        # edges between the first and last places where the order differs from the base's
+        preds: Dict[int, List[Tuple[int, float]]] = {}
+        succs: Dict[int, List[int]] = {}
+        for block_id in blocks:
+            base_nodes = self.blocks[block_id]
+            ranked = sorted(
+                [(self.keys[n], n) for n in base_nodes if n not in planned]
+                + [((planned[n],) + self.keys[n][1:], n) for n in base_nodes if n in planned]
+            )
+            nodes = [n for _, n in ranked]
+            first = next((j for j, (a, b) in enumerate(zip(nodes, base_nodes)) if a != b or a in owner), len(nodes))
+            prefix = set(nodes[:first])
+            base_order = self.order[block_id]
+            order = self._block_order(
+                nodes,
+                [planned.get(n, self.planned[n]) for n in nodes],
+                [owner.get(n, self.owner[n]) for n in nodes],
+                [n for n in base_order if n in prefix],
+            )
+            differ = [i for i, (a, b) in enumerate(zip(order, base_order)) if a != b]
+            if not differ:
+                continue
+            capacity = self._capacity(block_id)
+            lo, hi = differ[0], differ[-1]
+            for i in range(lo, min(len(order), hi + capacity + 1)):
+                n = order[i]
+                preds[n] = list(self.train_edges[n])
+                if i >= capacity:
+                    preds[n].append((order[i - capacity], self.run[order[i - capacity]]))
+            for i in range(max(0, lo - capacity), hi + 1):
+                n = order[i]
+                k = self.keys[n][2]
+                legs = self.legs[self.train_of[n]]
+                succs[n] = [legs[k + 1]] if k + 1 < len(legs) else []
+                if i + capacity < len(order):
+                    succs[n].append(order[i + capacity])
+        # label-correcting propagation in the base topological order, from the nodes whose
+        # floor or in-edges changed: a node whose start moves re-queues its successors, so
+        # one evaluated ahead of a new in-edge is redone
+        start: Dict[int, float] = {}
+        seeds = set(floor) | {n for n, ps in preds.items() if ps != self.preds[n]}
+        heap = [(self.topo[n], n) for n in seeds]
+        heapq.heapify(heap)
+        budget = 4 * len(self.keys)
+        while heap:
+            _, m = heapq.heappop(heap)
+            seeds.discard(m)
+            budget -= 1
+            if budget < 0:
+                # only a cycle keeps starts moving this long
+                return self._rebuilt_delays(shifts, new)
+            value = floor.get(m, self.floor[m])
+            for p, offset in preds.get(m, self.preds[m]):
+                value = max(value, start.get(p, self.start[p]) + offset)
+            if value == start.get(m, self.start[m]):
+                continue
+            start[m] = value
+            for q in succs.get(m, self.succs[m]):
+                if q not in seeds:
+                    seeds.add(q)
+                    heapq.heappush(heap, (self.topo[q], q))
+        delays: Dict[str, float] = {}
+        for tid, legs in self.legs.items():
+            d = 0.0
+            if legs:
+                n = legs[-1]
+                d = start.get(n, self.start[n]) - planned.get(n, self.planned[n])
+            delays[tid] = d + shifts.get(tid, 0.0)
+        return delays
+
+    def _rebuilt_delays(self, shifts: Dict[str, float], decisions: Dict[str, str]) -> Dict[str, float]:
+        # shifted_delays from a graph built over the shifted plan, replaying the delay reports
+        # (from the planned times: apply() may have rewritten the trains' occupancies)
+        trains = []
+        for tid, t in self.trains.items():
+            d = shifts.get(tid, 0.0)
+            occs = [BlockOccupancy(self.block_of[n], self.planned[n] + d, self.planned[n] + self.run[n] + d) for n in self.legs[tid]]
+            trains.append(Train(tid, t.category, t.priority, t.planned_path, occs, self.base_delay[tid]))
+        graph = DelayGraph(trains, self.capacities, decisions, self.now)
+        for tid, leg, delay in self.log:
+            graph.report_delay(tid, delay, leg, record=False)
+        return {tid: d + shifts.get(tid, 0.0) for tid, d in graph.delays().items()}
+
+    def eta(self, train_id: str) -> float:
+        # Propagated exit time of the train's last block
+        n = self.legs[train_id][-1]
+        return self.start[n] + self.run[n]
+
+    def delay(self, train_id: str) -> float:
+        legs = self.legs[train_id]
+        if not legs:
+            return 0.0
+        return self.start[legs[-1]] - self.planned[legs[-1]]
+
+    def delays(self) -> Dict[str, float]:
+        return {tid: self.delay(tid) for tid in self.legs}
+
+    def apply(self) -> None:
+        # Write propagated times into the trains; delay_minutes = initial + arrival delay
+        for tid, nodes in self.legs.items():
+            t = self.trains[tid]
+            for occ, n in zip(t.occupancies, nodes):
+                occ.start_time = self.start[n]
+                occ.end_time = self.start[n] + self.run[n]
+            t.delay_minutes = self.base_delay[tid] + self.delay(tid)
+
+
+def propagate_delays(
+    trains: List[Train],
+    capacities: Optional[Dict[BlockKey, int]] = None,
+    apply: bool = False,
+    decisions: Optional[Dict[str, str]] = None,
+    now: float = -math.inf,
+) -> DelayGraph:
+    # Build the delay graph; with apply=True the trains take the propagated times.
+    # Pass the decide_precedence result as ``decisions`` so the graph holds the same trains.
+    graph = DelayGraph(trains, capacities, decisions, now)
+    if apply:
+        graph.apply()
+    return graph
 
 
 # -----------------------------
@@ -205,41 +1400,496 @@ def propagate_delay_simple(trains: List[Train], added_delay_per_conflict: float
 # -----------------------------
 
 
-@dataclass
-class Event:
-    time: float
-    kind: str  # "enter_block" | "exit_block"
+class EventKind(IntEnum):
+    ENTER = 0
+    EXIT = 1
+    CONFLICT = 2
+    EXIT_WAIT = 3
+    WAIT = 4  # blocking mode: queued behind the block's holders
+
+
+class SimEvent(NamedTuple):
+    time: float  # exact simulation time in minutes
+    kind: EventKind
+    block_id: BlockKey
     train_id: str
-    block_id: str
+    other: Optional[str] = None  # block holder for CONFLICT and WAIT events
 
 
-def run_simulation(trains: List[Train]) -> List[str]:
-    log: List[str] = []
-    # Build initial event queue
-    pq: List[Tuple[float, int, Event]] = []
-    counter = 0
-    for t in trains:
-        for occ in t.occupancies:
-            heapq.heappush(pq, (occ.start_time, counter, Event(occ.start_time, "enter_block", t.train_id, occ.block_id)))
-            counter += 1
-            heapq.heappush(pq, (occ.end_time, counter, Event(occ.end_time, "exit_block", t.train_id, occ.block_id)))
-            counter += 1
-    occupied: Dict[str, Optional[str]] = {}
-    while pq:
-        ts, _, ev = heapq.heappop(pq)
-        if ev.kind == "enter_block":
-            if occupied.get(ev.block_id) is None:
-                occupied[ev.block_id] = ev.train_id
-                log.append(f"{ts:.1f} ENTER {ev.block_id} {ev.train_id}")
-            else:
-                holder = occupied[ev.block_id]
-                log.append(f"{ts:.1f} CONFLICT {ev.block_id} {ev.train_id} vs {holder}")
+def format_event(ev: SimEvent, symbols: Optional[SymbolTable] = None) -> str:
+    # Log-line rendering, only at the output edge; symbols map interned block ids to names
+    block = symbols.block_name(ev.block_id) if symbols is not None else ev.block_id
+    line = f"{ev.time:.1f} {ev.kind.name} {block} {ev.train_id}"
+    if ev.other is not None:
+        line += f" vs {ev.other}"
+    return line
+
+
+# Snapshot header: format name and version byte; the payload is zlib-compressed JSON
+SNAPSHOT_MAGIC = b"RSIM\x03"
+SNAPSHOT_VERSION = 3
+
+
+class Scheduler(Protocol):
+    """Pending-event queue of a Simulator: pops the smallest pushed item first."""
+
+    def __len__(self) -> int: ...
+
+    def push(self, item: tuple) -> None: ...
+
+    def pop(self) -> tuple: ...
+
+
+class EventSink(Protocol):
+    """Receives every simulation event as it is produced."""
+
+    def observe(self, ev: SimEvent) -> None: ...
+
+
+class HeapScheduler:
+    """Binary-heap event queue: O(log n) push and pop. Items are tuples led by their time."""
+
+    def __init__(self) -> None:
+        self._heap: List[tuple] = []
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def push(self, item: tuple) -> None:
+        heapq.heappush(self._heap, item)
+
+    def pop(self) -> tuple:
+        return heapq.heappop(self._heap)
+
+
+class CalendarQueue:
+    """Time-bucketed event queue for dense, nearly monotone event times.
+
+    Items land in buckets of ``width`` minutes. A bucket is sorted once, when the clock
+    reaches it, and then drained front to back; pushes into the bucket being drained
+    are inserted in order. Only the first push into a new bucket touches the heap of
+    bucket numbers, so with a width near the typical gap between events, push and pop
+    are O(1) amortised. Pop order is identical to ``HeapScheduler``.
+    """
+
+    def __init__(self, width: float = 1.0) -> None:
+        if width <= 0.0:
+            raise ValueError("width must be positive")
+        self.width = width
+        self._buckets: Dict[int, List[tuple]] = {}
+        self._days: List[int] = []
+        self._day = -math.inf  # bucket number being drained
+        self._current: List[tuple] = []
+        self._head = 0
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def push(self, item: tuple) -> None:
+        self._size += 1
+        day = math.floor(item[0] / self.width)
+        if day <= self._day:
+            # into the bucket being drained (or earlier, which still pops next)
+            bisect.insort(self._current, item, self._head)
+            return
+        bucket = self._buckets.get(day)
+        if bucket is None:
+            self._buckets[day] = [item]
+            heapq.heappush(self._days, day)
         else:
-            if occupied.get(ev.block_id) == ev.train_id:
-                occupied[ev.block_id] = None
-                log.append(f"{ts:.1f} EXIT {ev.block_id} {ev.train_id}")
+            bucket.append(item)
+
+    def pop(self) -> tuple:
+        if self._head == len(self._current):
+            if not self._days:
+                raise IndexError("pop from empty scheduler")
+            self._day = heapq.heappop(self._days)
+            self._current = self._buckets.pop(self._day)
+            self._current.sort()
+            self._head = 0
+        item = self._current[self._head]
+        self._head += 1
+        self._size -= 1
+        return item
+
+
+class FileEventSink:
+    """Writes each event as a log line to an open text file."""
+
+    def __init__(self, stream: TextIO, symbols: Optional[SymbolTable] = None) -> None:
+        self.stream = stream
+        self.symbols = symbols
+
+    def observe(self, ev: SimEvent) -> None:
+        self.stream.write(format_event(ev, self.symbols) + "\n")
+
+
+class Simulator:
+    """Streaming discrete-event simulation over the trains' block occupancies.
+
+    The queue holds at most one pending event per train, keyed (time, phase, train
+    index, event index): the next one is read from the train's occupancies only after
+    the previous one was processed, so memory is O(active trains) instead of O(all
+    events). The key reproduces the order of the old fully materialised queue. Events
+    are yielded by ``events()`` and delivered to every registered ``EventSink``; sinks
+    that also have ``observe_train(train)`` hear about finished trains.
+
+    By default the run replays the timetable: every train runs as planned, and one
+    entering a block already holding its capacity logs a CONFLICT against each train on
+    it (the pairs ``detect_block_conflicts`` reports) and later exits with EXIT_WAIT.
+    With ``blocking=True`` trains really wait: a block admits up to its capacity,
+    later arrivals queue on it (WAIT event) ordered by ``compute_priority_score``, and
+    a queued train enters when a holder exits. Waits shift that occupancy and every
+    later one of the train; actual times are written back into the occupancies and the
+    wait is added to ``delay_minutes``. In both modes exits sort before entries at the
+    same instant, and a queued train does not keep holding the block it left.
+
+    ``scheduler`` is the pending-event queue, any ``Scheduler``: ``HeapScheduler``
+    (default) or ``CalendarQueue``.
+
+    A simulator can keep running while the timetable grows: ``add_trains`` feeds new
+    trains in, ``replan`` picks up edits to legs not yet reached, and ``forget_finished``
+    drops trains that are done, so one instance can follow an open-ended horizon.
+    """
+
+    def __init__(
+        self,
+        trains: List[Train],
+        sinks: Iterable[EventSink] = (),
+        blocking: bool = False,
+        capacities: Optional[Dict[BlockKey, int]] = None,
+        scheduler: Optional[Scheduler] = None,
+    ) -> None:
+        self._setup(trains, sinks, blocking, capacities, scheduler)
+        for ti, t in enumerate(trains):
+            if not t.occupancies:
+                self._train_done(t)
+                continue
+            self._push(ti, 0)
+
+    def _setup(
+        self,
+        trains: List[Train],
+        sinks: Iterable[EventSink],
+        blocking: bool,
+        capacities: Optional[Dict[BlockKey, int]],
+        scheduler: Optional[Scheduler],
+    ) -> None:
+        # Empty state for the given trains, with nothing queued yet
+        self.trains = list(trains)
+        self.sinks: List[EventSink] = list(sinks)
+        self.blocking = blocking
+        self.capacities = capacities or {}
+        # pending events: (time, phase, train index, event index, event position)
+        self.queue: Scheduler = scheduler if scheduler is not None else HeapScheduler()
+        # trains on each block (insertion-ordered), flagged True when they entered it above
+        # capacity (replay mode only), and blocking mode's per-block wait queues of
+        # (-priority score, seq, train index, event position, requested time)
+        self.holders: Dict[BlockKey, Dict[str, bool]] = {}
+        self.waiting: Dict[BlockKey, List[Tuple[float, int, int, int, float]]] = {}
+        self.shift: List[float] = [0.0] * len(trains)
+        self.waits: Dict[str, float] = {}
+        self._seq = 0
+        self._out: List[SimEvent] = []
+        self.now = -math.inf  # time of the last processed event
+        # per-train event order, only for trains whose occupancies are not in time order;
+        # times are still read from the occupancies, so later edits are seen
+        self._sorted: Dict[int, List[int]] = {}
+        for ti in range(len(trains)):
+            self._order(ti)
+
+    def _order(self, ti: int) -> None:
+        if self.blocking:
+            return
+        times = [x for occ in self.trains[ti].occupancies for x in (occ.start_time, occ.end_time)]
+        if any(b < a for a, b in zip(times, times[1:])):
+            self._sorted[ti] = sorted(range(len(times)), key=lambda e: (times[e], e))
+
+    def add_trains(self, trains: Iterable[Train]) -> None:
+        # Feed more trains into a running simulation; their events join the queue
+        for t in trains:
+            ti = len(self.trains)
+            self.trains.append(t)
+            self.shift.append(0.0)
+            if not t.occupancies:
+                self._train_done(t)
+                continue
+            self._order(ti)
+            self._push(ti, 0, self.now)
+
+    def replan(self) -> None:
+        # Re-read the queued events' times after trains' legs not yet reached were edited
+        # (e.g. held by a headway pass); nothing is moved before the current time
+        pending = [self.queue.pop() for _ in range(len(self.queue))]
+        for _, _, ti, _, pos in pending:
+            self._push(ti, pos, self.now)
+
+    def forget_finished(self) -> None:
+        # Drop trains with nothing queued or waiting, so a simulator fed by add_trains
+        # holds only live trains. Train indices shift down, keeping their order.
+        pending = [self.queue.pop() for _ in range(len(self.queue))]
+        live = sorted({item[2] for item in pending} | {w[2] for q in self.waiting.values() for w in q})
+        remap = {old: new for new, old in enumerate(live)}
+        self.trains = [self.trains[ti] for ti in live]
+        self.shift = [self.shift[ti] for ti in live]
+        self._sorted = {remap[ti]: order for ti, order in self._sorted.items() if ti in remap}
+        for ts, phase, ti, e, pos in pending:
+            self.queue.push((ts, phase, remap[ti], e, pos))
+        self.waiting = {
+            b: [(score, seq, remap[ti], pos, ts) for score, seq, ti, pos, ts in q] for b, q in self.waiting.items()
+        }
+
+    def add_sink(self, sink: EventSink) -> None:
+        self.sinks.append(sink)
+
+    def _event(self, ti: int, pos: int) -> Tuple[float, int]:
+        # (time, event index) of the train's pos-th event; even indices enter, odd ones exit
+        order = self._sorted.get(ti)
+        e = order[pos] if order is not None else pos
+        occ = self.trains[ti].occupancies[e // 2]
+        return (occ.end_time if e % 2 else occ.start_time), e
+
+    def _push(self, ti: int, pos: int, not_before: float = -math.inf) -> None:
+        ts, e = self._event(ti, pos)
+        if self.blocking:
+            # entries still carry the planned time; exits were rewritten on admission.
+            # A delayed train never runs earlier than the event that released it.
+            if e % 2 == 0:
+                ts += self.shift[ti]
+            ts = max(ts, not_before)
+        # occupancies are half-open: a block left at ts is free for an entry at ts
+        phase = 1 - e % 2
+        self.queue.push((ts, phase, ti, e, pos))
+
+    def _train_done(self, train: Train) -> None:
+        for sink in self.sinks:
+            observe_train = getattr(sink, "observe_train", None)
+            if observe_train is not None:
+                observe_train(train)
+
+    def _emit(self, ev: SimEvent) -> None:
+        self._out.append(ev)
+        for sink in self.sinks:
+            sink.observe(ev)
+
+    def _advance(self, ti: int, pos: int, ts: float) -> None:
+        if pos + 1 < 2 * len(self.trains[ti].occupancies):
+            self._push(ti, pos + 1, ts)
+        else:
+            self._train_done(self.trains[ti])
+
+    def _admit(self, ti: int, pos: int, ts: float) -> None:
+        # Enter the block at ts; any wait moves this occupancy and everything after it
+        t = self.trains[ti]
+        occ = t.occupancies[pos // 2]
+        wait = ts - (occ.start_time + self.shift[ti])
+        if wait > 0.0:
+            self.shift[ti] += wait
+            self.waits[t.train_id] = self.waits.get(t.train_id, 0.0) + wait
+            t.delay_minutes += wait
+        # written from ts, not planned + shift: the sum can land an ulp off the time the
+        # block was actually granted and overlap the train admitted next
+        run = occ.end_time - occ.start_time
+        occ.start_time = ts
+        occ.end_time = ts + run
+        self.holders.setdefault(occ.block_id, {})[t.train_id] = False
+        self._emit(SimEvent(ts, EventKind.ENTER, occ.block_id, t.train_id))
+        self._advance(ti, pos, ts)
+
+    def _step_blocking(self, ts: float, ti: int, pos: int) -> None:
+        t = self.trains[ti]
+        block_id = t.occupancies[pos // 2].block_id
+        holders = self.holders.get(block_id)
+        if pos % 2 == 0:
+            capacity = max(1, self.capacities.get(block_id, 1))
+            if holders and len(holders) >= capacity:
+                self._seq += 1
+                queue = self.waiting.setdefault(block_id, [])
+                heapq.heappush(queue, (-compute_priority_score(t), self._seq, ti, pos, ts))
+                self._emit(SimEvent(ts, EventKind.WAIT, block_id, t.train_id, next(iter(holders))))
+            else:
+                self._admit(ti, pos, ts)
+            return
+        # exit: the occupancy was already shifted on entry, so its end time is final
+        if holders is not None:
+            holders.pop(t.train_id, None)
+        self._emit(SimEvent(ts, EventKind.EXIT, block_id, t.train_id))
+        self._advance(ti, pos, ts)
+        waiting = self.waiting.get(block_id)
+        if waiting:
+            _, _, wi, wpos, _ = heapq.heappop(waiting)
+            self._admit(wi, wpos, ts)
+
+    def step(self, until: Optional[float] = None) -> List[SimEvent]:
+        # Process the next queued event; returns the events it produced (a blocking-mode
+        # exit also admits the next waiting train). Nothing happens if the queue is empty
+        # or the next event lies after ``until``.
+        self._out = []
+        if not len(self.queue):
+            return self._out
+        item = self.queue.pop()
+        if until is not None and item[0] > until:
+            self.queue.push(item)
+            return self._out
+        ts, _, ti, e, pos = item
+        self.now = ts
+        if self.blocking:
+            self._step_blocking(ts, ti, pos)
+            return self._out
+        t = self.trains[ti]
+        block_id = t.occupancies[e // 2].block_id
+        holders = self.holders.setdefault(block_id, {})
+        if e % 2 == 0:
+            over = len(holders) >= max(1, self.capacities.get(block_id, 1))
+            if over:
+                for other in list(holders):
+                    self._emit(SimEvent(ts, EventKind.CONFLICT, block_id, t.train_id, other))
             else:
-                log.append(f"{ts:.1f} EXIT_WAIT {ev.block_id} {ev.train_id}")
+                self._emit(SimEvent(ts, EventKind.ENTER, block_id, t.train_id))
+            holders[t.train_id] = over
+        elif holders.pop(t.train_id, True):
+            self._emit(SimEvent(ts, EventKind.EXIT_WAIT, block_id, t.train_id))
+        else:
+            self._emit(SimEvent(ts, EventKind.EXIT, block_id, t.train_id))
+        self._advance(ti, pos, ts)
+        return self._out
+
+    def events(self, until: Optional[float] = None) -> Iterator[SimEvent]:
+        # Run to the end, or through every event at or before ``until``
+        while len(self.queue):
+            out = self.step(until)
+            if not out:
+                return
+            yield from out
+
+    # -----------------------------
+    # Checkpoints
+    # -----------------------------
+
+    def snapshot(self) -> bytes:
+        """Serialise the simulation state as versioned JSON: clock, pending events, block
+        holders and wait queues, the times and delays the run has written into the trains,
+        and the running totals of every KpiAccumulator sink.
+
+        Trains are recorded by id and schedule only; ``restore`` takes the train objects
+        again. Other sinks (open files) are not saved; pass them to ``restore``.
+        """
+        pending = [self.queue.pop() for _ in range(len(self.queue))]
+        for item in pending:
+            self.queue.push(item)
+        state = {
+            "version": SNAPSHOT_VERSION,
+            "now": None if self.now == -math.inf else self.now,
+            "blocking": self.blocking,
+            "capacities": [[b, c] for b, c in self.capacities.items()],
+            "queue": [list(item) for item in pending],
+            "holders": [[b, [[tid, over] for tid, over in h.items()]] for b, h in self.holders.items() if h],
+            "waiting": [[b, [list(w) for w in q]] for b, q in self.waiting.items() if q],
+            "shift": self.shift,
+            "waits": self.waits,
+            "seq": self._seq,
+            "trains": [
+                {
+                    "id": t.train_id,
+                    "delay_minutes": t.delay_minutes,
+                    "legs": [[o.block_id, o.start_time, o.end_time] for o in t.occupancies],
+                }
+                for t in self.trains
+            ],
+            "kpis": [sink.state() for sink in self.sinks if isinstance(sink, KpiAccumulator)],
+        }
+        return SNAPSHOT_MAGIC + zlib.compress(json.dumps(state, allow_nan=False).encode("utf-8"), 6)
+
+    @classmethod
+    def restore(
+        cls,
+        data: bytes,
+        trains: List[Train],
+        sinks: Iterable[EventSink] = (),
+        scheduler: Optional[Scheduler] = None,
+    ) -> "Simulator":
+        # Resume a snapshot over ``trains`` (the same ids and blocks, e.g. rebuilt from the
+        # timetable): their times and delays are reset to the snapshot's. Saved KPI
+        # accumulators come back as the first sinks, followed by ``sinks``.
+        if not data.startswith(SNAPSHOT_MAGIC):
+            raise ValueError("not a simulator snapshot (bad header or version)")
+        try:
+            state = json.loads(zlib.decompress(data[len(SNAPSHOT_MAGIC):]).decode("utf-8"))
+        except (zlib.error, UnicodeDecodeError, json.JSONDecodeError) as e:
+            raise ValueError(f"corrupt simulator snapshot: {e}") from e
+        if state.get("version") != SNAPSHOT_VERSION:
+            raise ValueError(f"unsupported snapshot version {state.get('version')!r}")
+        saved = state["trains"]
+        if len(saved) != len(trains) or any(
+            rec["id"] != t.train_id or [leg[0] for leg in rec["legs"]] != [o.block_id for o in t.occupancies]
+            for rec, t in zip(saved, trains)
+        ):
+            raise ValueError("snapshot does not match the given trains")
+        for rec, t in zip(saved, trains):
+            t.delay_minutes = rec["delay_minutes"]
+            for occ, (_, start, end) in zip(t.occupancies, rec["legs"]):
+                occ.start_time, occ.end_time = start, end
+        kpis = [KpiAccumulator.from_state(k) for k in state["kpis"]]
+        sim = cls.__new__(cls)
+        sim._setup(trains, kpis + list(sinks), state["blocking"], dict(state["capacities"]), scheduler)
+        for item in state["queue"]:
+            sim.queue.push(tuple(item))
+        sim.holders = {b: dict(h) for b, h in state["holders"]}
+        sim.waiting = {b: [tuple(w) for w in q] for b, q in state["waiting"]}
+        sim.shift = state["shift"]
+        sim.waits = state["waits"]
+        sim._seq = state["seq"]
+        sim.now = -math.inf if state["now"] is None else state["now"]
+        return sim
+
+    def fork(self, scheduler: Optional[Scheduler] = None) -> "Simulator":
+        # Independent copy, over copied trains, that continues from the current time.
+        # Occupancies whose events are not queued yet are read lazily, so a branch may
+        # edit trains' future legs before resuming.
+        return Simulator.restore(self.snapshot(), copy.deepcopy(self.trains), scheduler=scheduler)
+
+
+def iter_simulation(
+    trains: List[Train],
+    sinks: Iterable[EventSink] = (),
+    blocking: bool = False,
+    capacities: Optional[Dict[BlockKey, int]] = None,
+    scheduler: Optional[Scheduler] = None,
+) -> Iterator[SimEvent]:
+    return Simulator(trains, sinks, blocking, capacities, scheduler).events()
+
+
+def run_simulation(
+    trains: List[Train],
+    kpis: Optional["KpiAccumulator"] = None,
+    keep_log: bool = True,
+    sinks: Iterable[EventSink] = (),
+    blocking: bool = False,
+    capacities: Optional[Dict[BlockKey, int]] = None,
+    scheduler: Optional[Scheduler] = None,
+    checkpoints: Iterable[float] = (),
+    on_checkpoint: Optional[Callable[[float, bytes], None]] = None,
+) -> List[SimEvent]:
+    # Events are also fed to ``kpis`` and ``sinks`` as they are produced; with keep_log=False
+    # nothing is retained and the returned list is empty. See Simulator for blocking mode.
+    # At each checkpoint time (after every event at or before it) a Simulator.snapshot is
+    # passed to ``on_checkpoint``; resume or branch from it with Simulator.restore, giving
+    # it the trains again.
+    all_sinks = list(sinks)
+    if kpis is not None:
+        all_sinks.append(kpis)
+    sim = Simulator(trains, all_sinks, blocking, capacities, scheduler)
+    log: List[SimEvent] = []
+    for cp in sorted(checkpoints):
+        for ev in sim.events(until=cp):
+            if keep_log:
+                log.append(ev)
+        if on_checkpoint is not None:
+            on_checkpoint(cp, sim.snapshot())
+    for ev in sim.events():
+        if keep_log:
+            log.append(ev)
     return log
 
 
@@ -248,47 +1898,168 @@ def run_simulation(trains: List[Train]) -> List[str]:
 # -----------------------------
 
 
-def compute_kpis(trains: List[Train], sim_log: List[str]) -> Dict[str, float]:
-    n = max(1, len(trains))
-    avg_delay = sum(t.delay_minutes for t in trains) / n
-    throughput = sum(1 for line in sim_log if "EXIT" in line and "EXIT_WAIT" not in line)
-    # utilization: fraction of time blocks were occupied (approximate via events)
-    block_times: Dict[str, float] = {}
-    last_enter: Dict[str, float] = {}
-    for line in sim_log:
-        parts = line.split()
-        ts = float(parts[0])
-        kind = parts[1]
-        block_id = parts[2]
-        if kind == "ENTER":
-            last_enter[block_id] = ts
-        if kind == "EXIT":
-            if block_id in last_enter:
-                block_times[block_id] = block_times.get(block_id, 0.0) + (ts - last_enter[block_id])
-                last_enter.pop(block_id, None)
-    total_time = 1.0
-    if sim_log:
-        first_ts = float(sim_log[0].split()[0])
-        last_ts = float(sim_log[-1].split()[0])
-        total_time = max(1.0, last_ts - first_ts)
-    utilization = 0.0
-    if block_times:
-        utilization = sum(block_times.values()) / (len(block_times) * total_time)
-    # punctuality: percent with zero additional delay
-    punctuality = 100.0 * sum(1 for t in trains if t.delay_minutes <= 0.01) / n
-    # safety violations: count of headway violations and conflicts
-    safety_violations = 0
-    for line in sim_log:
-        if "VIOLATION" in line or "CONFLICT" in line:
-            safety_violations += 1
-    
-    return {
-        "average_delay": avg_delay,
-        "throughput": float(throughput),
-        "utilization": utilization,
-        "punctuality": punctuality,
-        "safety_violations": safety_violations,
-    }
+class QuantileSketch:
+    """Log-bucketed histogram with bounded relative error (DDSketch-style).
+
+    Values land in buckets whose bounds grow by ``gamma``, so any quantile is returned
+    within ``relative_accuracy`` of a true sample value. Memory is capped by
+    ``max_buckets``: past it, the lowest buckets are merged, which only degrades the
+    smallest quantiles.
+    """
+
+    def __init__(self, relative_accuracy: float = 0.01, max_buckets: int = 2048, min_value: float = 1e-3) -> None:
+        self.gamma = (1.0 + relative_accuracy) / (1.0 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.max_buckets = max_buckets
+        self.min_value = min_value
+        self.buckets: Dict[int, int] = {}
+        self.zero_count = 0
+        self.count = 0
+
+    def add(self, value: float) -> None:
+        self.count += 1
+        if value <= self.min_value:
+            self.zero_count += 1
+            return
+        k = math.ceil(math.log(value) / self.log_gamma)
+        self.buckets[k] = self.buckets.get(k, 0) + 1
+        if len(self.buckets) > self.max_buckets:
+            low = sorted(self.buckets)[:2]
+            self.buckets[low[1]] += self.buckets.pop(low[0])
+
+    def quantile(self, q: float) -> float:
+        if self.count == 0:
+            return 0.0
+        # nearest rank: the smallest value with at least q of the samples at or below it
+        rank = max(1, math.ceil(q * self.count))
+        seen = self.zero_count
+        if rank <= seen:
+            return 0.0
+        for k in sorted(self.buckets):
+            seen += self.buckets[k]
+            if rank <= seen:
+                return 2.0 * self.gamma ** k / (self.gamma + 1.0)
+        return 2.0 * self.gamma ** max(self.buckets) / (self.gamma + 1.0)
+
+
+class KpiAccumulator:
+    """Single-pass KPI state, updated per simulation event and per finished train.
+
+    Memory is bounded by the number of blocks plus a fixed-size delay sketch, not by
+    the number of events, so KPIs for long horizons need no event log.
+    """
+
+    def __init__(self, punctual_threshold_min: float = 0.01) -> None:
+        self.punctual_threshold_min = punctual_threshold_min
+        self.throughput = 0
+        self.safety_violations = 0
+        self.block_times: Dict[BlockKey, float] = {}
+        self.last_enter: Dict[BlockKey, float] = {}
+        self.first_ts: Optional[float] = None
+        self.last_ts: Optional[float] = None
+        self.trains = 0
+        self.punctual = 0
+        self.delay_sum = 0.0
+        self.delays = QuantileSketch()
+
+    def observe(self, ev: SimEvent) -> None:
+        if self.first_ts is None:
+            self.first_ts = ev.time
+        self.last_ts = ev.time
+        if ev.kind == EventKind.ENTER:
+            self.last_enter[ev.block_id] = ev.time
+        elif ev.kind == EventKind.EXIT:
+            self.throughput += 1
+            entered = self.last_enter.pop(ev.block_id, None)
+            if entered is not None:
+                self.block_times[ev.block_id] = self.block_times.get(ev.block_id, 0.0) + (ev.time - entered)
+        elif ev.kind == EventKind.CONFLICT:
+            self.safety_violations += 1
+
+    def observe_train(self, train: Train, delay: Optional[float] = None) -> None:
+        d = train.delay_minutes if delay is None else delay
+        self.trains += 1
+        self.delay_sum += d
+        if d <= self.punctual_threshold_min:
+            self.punctual += 1
+        self.delays.add(max(0.0, d))
+
+    def state(self) -> Dict[str, Any]:
+        # Running totals as plain JSON values, for simulator snapshots
+        return {
+            "punctual_threshold_min": self.punctual_threshold_min,
+            "throughput": self.throughput,
+            "safety_violations": self.safety_violations,
+            "block_times": [[b, v] for b, v in self.block_times.items()],
+            "last_enter": [[b, v] for b, v in self.last_enter.items()],
+            "first_ts": self.first_ts,
+            "last_ts": self.last_ts,
+            "trains": self.trains,
+            "punctual": self.punctual,
+            "delay_sum": self.delay_sum,
+            "delays": {
+                "gamma": self.delays.gamma,
+                "max_buckets": self.delays.max_buckets,
+                "min_value": self.delays.min_value,
+                "buckets": [[k, n] for k, n in self.delays.buckets.items()],
+                "zero_count": self.delays.zero_count,
+                "count": self.delays.count,
+            },
+        }
+
+    @classmethod
+    def from_state(cls, state: Dict[str, Any]) -> "KpiAccumulator":
+        acc = cls(state["punctual_threshold_min"])
+        acc.throughput = state["throughput"]
+        acc.safety_violations = state["safety_violations"]
+        acc.block_times = dict(state["block_times"])
+        acc.last_enter = dict(state["last_enter"])
+        acc.first_ts = state["first_ts"]
+        acc.last_ts = state["last_ts"]
+        acc.trains = state["trains"]
+        acc.punctual = state["punctual"]
+        acc.delay_sum = state["delay_sum"]
+        sketch = state["delays"]
+        acc.delays.gamma = sketch["gamma"]
+        acc.delays.log_gamma = math.log(acc.delays.gamma)
+        acc.delays.max_buckets = sketch["max_buckets"]
+        acc.delays.min_value = sketch["min_value"]
+        acc.delays.buckets = dict(sketch["buckets"])
+        acc.delays.zero_count = sketch["zero_count"]
+        acc.delays.count = sketch["count"]
+        return acc
+
+    def result(self) -> Dict[str, float]:
+        n = max(1, self.trains)
+        total_time = 1.0
+        if self.first_ts is not None and self.last_ts is not None:
+            total_time = max(1.0, self.last_ts - self.first_ts)
+        # utilization: fraction of time blocks were occupied
+        utilization = 0.0
+        if self.block_times:
+            utilization = sum(self.block_times.values()) / (len(self.block_times) * total_time)
+        return {
+            "average_delay": self.delay_sum / n,
+            "throughput": float(self.throughput),
+            "utilization": utilization,
+            # punctuality: percent with zero additional delay
+            "punctuality": 100.0 * self.punctual / n,
+            # safety violations: count of headway violations and conflicts
+            "safety_violations": self.safety_violations,
+            "delay_p50": self.delays.quantile(0.50),
+            "delay_p95": self.delays.quantile(0.95),
+            "delay_p99": self.delays.quantile(0.99),
+        }
+
+
+def compute_kpis(trains: List[Train], sim_log: List[SimEvent]) -> Dict[str, float]:
+    # Replays a retained log; pass a KpiAccumulator to run_simulation to skip the log entirely
+    acc = KpiAccumulator()
+    for ev in sim_log:
+        acc.observe(ev)
+    for t in trains:
+        acc.observe_train(t)
+    return acc.result()
 
 
 # -----------------------------
@@ -354,7 +2125,7 @@ def minimal_demo() -> None:
     for _, a, b, _ in block_conflicts:
         id_pairs.add(tuple(sorted((a, b))))
     decisions = decide_precedence(list(id_pairs), {t.train_id: t for t in trains})
-    propagate_delay_simple(trains)
+    delays = propagate_delays(trains, apply=True, decisions=decisions).delays()
     log = run_simulation(trains)
     kpis = compute_kpis(trains, log)
     print("Conflicts:")
@@ -362,9 +2133,11 @@ def minimal_demo() -> None:
         print(c)
     print("Decisions:")
     print(decisions)
+    print("Propagated arrival delays:")
+    print(delays)
     print("Sim log:")
-    for line in log:
-        print(line)
+    for ev in log:
+        print(format_event(ev))
     print("KPIs:")
     print(kpis)
 
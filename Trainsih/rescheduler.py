@@ -0,0 +1,272 @@
+from __future__ import annotations
+
+import math
+import random
+import time
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from rail_decision_engine import BlockKey, BlockOccupancy, Train
+from occupancy_index import OccupancyIndex
+
+
+# -----------------------------
+# Anytime local-search rescheduling
+# -----------------------------
+
+
+PASSENGER_CATEGORIES = {"passenger", "express", "superfast", "mail", "special", "local/emu", "local"}
+
+# penalty per minute of over-capacity block overlap; large enough that removing a conflict
+# always beats the delay it costs
+CONFLICT_WEIGHT = 100.0
+
+# annealing temperatures, in cost units (roughly minutes of priority-weighted delay)
+T0 = 20.0
+T_END = 0.05
+
+# (block, train on the block, entering train, overlap window), as detect_block_conflicts reports
+Conflict = Tuple[BlockKey, str, str, Tuple[float, float]]
+
+
+def _conflict_cost(conflicts: Iterable[Conflict]) -> float:
+    return CONFLICT_WEIGHT * sum(w[1] - w[0] for *_, w in conflicts)
+
+
+def _delay_cost(train: Train, delay: float, goal: str) -> float:
+    # Cost of holding ``train`` by ``delay`` minutes at its destination under the given goal
+    if delay <= 0.0:
+        return 0.0
+    if goal == "minimize_delay":
+        return delay
+    if goal == "maximize_throughput":
+        # every disturbed train costs extra, so fewer trains get held
+        return delay + 10.0
+    weight = train.priority * (2.0 if train.category in PASSENGER_CATEGORIES else 1.0)
+    if goal == "balance":
+        # quadratic term spreads delay instead of piling it on one train
+        return 0.5 * weight * delay + 0.05 * delay * delay
+    return weight * delay  # prioritize_passenger
+
+
+@dataclass
+class RescheduleResult:
+    goal: str
+    holds: Dict[str, List[float]]  # train_id -> minutes held before each occupancy (non-zero trains only)
+    initial_cost: float
+    best_cost: float
+    iterations: int = 0
+    accepted: int = 0
+    elapsed_ms: float = 0.0
+    remaining_conflicts: int = 0
+    delays: Dict[str, float] = field(default_factory=dict)
+
+    def apply(self, trains: List[Train]) -> None:
+        # Shift occupancies by the accumulated holds and book the added delay on each train
+        for t in trains:
+            holds = self.holds.get(t.train_id)
+            if not holds:
+                continue
+            shift = 0.0
+            for occ, hold in zip(t.occupancies, holds):
+                shift += hold
+                occ.start_time += shift
+                occ.end_time += shift
+            t.delay_minutes += shift
+
+
+class _Search:
+    """Working state for the local search.
+
+    Each train carries a hold per occupancy; the cumulative hold shifts that occupancy
+    and everything after it. The current schedule lives in an OccupancyIndex, together
+    with each block's conflicts as the detector's sweep reports them. A move only
+    changes the blocks the moved train uses, so it is priced by re-sweeping those blocks
+    with the train's proposed occupancies overlaid; with capacity above one this also
+    picks up pairs of other trains that the move creates or clears.
+    """
+
+    def __init__(self, trains: List[Train], capacities: Optional[Dict[BlockKey, int]], goal: str) -> None:
+        self.goal = goal
+        self.base = {t.train_id: [(o.start_time, o.end_time) for o in t.occupancies] for t in trains}
+        self.work = {
+            t.train_id: Train(t.train_id, t.category, t.priority, t.planned_path,
+                              [BlockOccupancy(o.block_id, o.start_time, o.end_time) for o in t.occupancies],
+                              t.delay_minutes)
+            for t in trains
+        }
+        self.holds: Dict[str, List[float]] = {t.train_id: [0.0] * len(t.occupancies) for t in trains}
+        self.index = OccupancyIndex.from_trains(self.work.values(), capacities)
+        self.block_conflicts: Dict[BlockKey, List[Conflict]] = {}
+        self.conflict_count: Dict[str, int] = {}
+        # insertion-ordered sets (dict keys) keep random picks reproducible across runs
+        self.conflicted: Dict[str, None] = {}
+        self.held: Dict[str, None] = {}
+        blocks = dict.fromkeys(o.block_id for t in self.work.values() for o in t.occupancies)
+        for block_id in blocks:
+            self._set_block(block_id, self.index.block_conflicts(block_id))
+        self.cost = self.recompute()
+
+    def recompute(self) -> float:
+        # The current cost from scratch: every block's conflicts plus every train's holds
+        return sum(_conflict_cost(c) for c in self.block_conflicts.values()) + sum(
+            self._train_delay_cost(tid) for tid in self.work
+        )
+
+    def _occupancies_for(self, tid: str, holds: List[float]) -> List[BlockOccupancy]:
+        shift = 0.0
+        out: List[BlockOccupancy] = []
+        for occ, (s, e), hold in zip(self.work[tid].occupancies, self.base[tid], holds):
+            shift += hold
+            out.append(BlockOccupancy(occ.block_id, s + shift, e + shift))
+        return out
+
+    def _set_block(self, block_id: BlockKey, conflicts: List[Conflict]) -> None:
+        for sign, pairs in ((-1, self.block_conflicts.get(block_id, ())), (1, conflicts)):
+            for _, a, b, _ in pairs:
+                for tid in (a, b):
+                    n = self.conflict_count[tid] = self.conflict_count.get(tid, 0) + sign
+                    if n:
+                        self.conflicted[tid] = None
+                    else:
+                        self.conflicted.pop(tid, None)
+        if conflicts:
+            self.block_conflicts[block_id] = conflicts
+        else:
+            self.block_conflicts.pop(block_id, None)
+
+    def _leg_at(self, tid: str, block_id: BlockKey, window: tuple) -> Optional[int]:
+        # Position of the train's leg on ``block_id`` that covers a conflict window
+        for i, o in enumerate(self.work[tid].occupancies):
+            if o.block_id == block_id and o.start_time <= window[0] and o.end_time >= window[1]:
+                return i
+        return None
+
+    def _train_delay_cost(self, tid: str, holds: Optional[List[float]] = None) -> float:
+        return _delay_cost(self.work[tid], sum(holds if holds is not None else self.holds[tid]), self.goal)
+
+    def propose(self, rng: random.Random) -> List[tuple]:
+        # Candidate moves: either resolve a conflict (hold one side until the other clears
+        # the block; both sides are offered, so precedence can swap) or give back part of
+        # an existing hold.
+        if self.conflicted and (rng.random() < 0.8 or not self.held):
+            tid = rng.choice(list(self.conflicted))
+            # the train's conflicts, each with the other train and both legs involved, so
+            # a train visiting the same block twice holds the visit that actually clashes
+            conflicts = []
+            for block_id in dict.fromkeys(o.block_id for o in self.work[tid].occupancies):
+                for _, a, b, window in self.block_conflicts.get(block_id, ()):
+                    if tid in (a, b):
+                        other = b if a == tid else a
+                        k, j = self._leg_at(tid, block_id, window), self._leg_at(other, block_id, window)
+                        if k is not None and j is not None:
+                            conflicts.append((tid, k, other, j))
+            if not conflicts:
+                return []
+            a, ka, b, kb = rng.choice(conflicts)
+            moves = []
+            for mover, k, leader, j in ((a, ka, b, kb), (b, kb, a, ka)):
+                wait = self.work[leader].occupancies[j].end_time - self.work[mover].occupancies[k].start_time
+                if wait > 0.0:
+                    holds = list(self.holds[mover])
+                    holds[k] += wait
+                    moves.append((mover, holds))
+            return moves
+        if not self.held:
+            return []
+        tid = rng.choice(list(self.held))
+        holds = list(self.holds[tid])
+        k = rng.choice([i for i, h in enumerate(holds) if h > 0.0])
+        holds[k] *= rng.choice((0.0, 0.5))
+        return [(tid, holds)]
+
+    def delta(self, tid: str, holds: List[float]) -> tuple:
+        # Cost change of giving ``tid`` these holds: its blocks re-swept as if it had moved
+        occupancies = self._occupancies_for(tid, holds)
+        overlay = {tid: occupancies}
+        swept = {
+            block_id: self.index.block_conflicts(block_id, overlay)
+            for block_id in dict.fromkeys(o.block_id for o in occupancies)
+        }
+        d = sum(_conflict_cost(c) - _conflict_cost(self.block_conflicts.get(b, ())) for b, c in swept.items())
+        d += self._train_delay_cost(tid, holds) - self._train_delay_cost(tid)
+        return d, occupancies, swept
+
+    def commit(self, tid: str, holds: List[float], occupancies: List[BlockOccupancy], swept, d: float) -> None:
+        self.holds[tid] = holds
+        if any(holds):
+            self.held[tid] = None
+        else:
+            self.held.pop(tid, None)
+        self.work[tid].occupancies = occupancies
+        self.index.update(self.work[tid])
+        for block_id, conflicts in swept.items():
+            self._set_block(block_id, conflicts)
+        self.cost += d
+
+
+def reschedule(
+    trains: List[Train],
+    capacities: Optional[Dict[BlockKey, int]] = None,
+    optimization_goal: str = "prioritize_passenger",
+    budget_ms: float = 200.0,
+    seed: int = 0,
+    patience: int = 500,
+) -> RescheduleResult:
+    """Simulated annealing over per-block holds, returning the best schedule found.
+
+    The input trains are not modified; call ``RescheduleResult.apply`` to adopt the plan.
+    The search stops at ``budget_ms`` of wall-clock time, after ``patience`` iterations
+    without improving the best cost, or as soon as the schedule is conflict-free with no
+    holds left to give back.
+    """
+    clock = time.perf_counter()
+    deadline = clock + budget_ms / 1000.0
+    rng = random.Random(seed)
+    search = _Search(trains, capacities, optimization_goal)
+    initial = search.cost
+    best_cost = search.cost
+    best_holds = {tid: list(h) for tid, h in search.holds.items() if any(h)}
+    iterations = accepted = stale = 0
+    while True:
+        now = time.perf_counter()
+        if now >= deadline or stale >= patience or (not search.conflicted and not search.held):
+            break
+        # geometric cooling over the wall-clock budget, from T0 down to T_END minutes of cost
+        temperature = T0 * (T_END / T0) ** ((now - clock) / (deadline - clock))
+        iterations += 1
+        stale += 1
+        moves = search.propose(rng)
+        if not moves:
+            continue
+        # of the candidates, the cheapest is put to the acceptance test
+        tid, holds, (d, occupancies, swept) = min(
+            ((tid, holds, search.delta(tid, holds)) for tid, holds in moves), key=lambda m: m[2][0]
+        )
+        if d <= 0.0 or rng.random() < math.exp(-d / temperature):
+            search.commit(tid, holds, occupancies, swept, d)
+            accepted += 1
+            if search.cost < best_cost - 1e-9:
+                best_cost = search.cost
+                stale = 0
+                best_holds = {t: list(h) for t, h in search.holds.items() if any(h)}
+    # price and count the best plan from scratch rather than trusting accumulated deltas:
+    # its conflicts as the detector sees the shifted trains, plus the cost of its holds
+    shifted = [
+        Train(t.train_id, t.category, t.priority, t.planned_path,
+              search._occupancies_for(t.train_id, best_holds.get(t.train_id, [0.0] * len(t.occupancies))))
+        for t in trains
+    ]
+    best = _Search(shifted, capacities, optimization_goal)
+    best_cost = best.recompute() + sum(search._train_delay_cost(tid, h) for tid, h in best_holds.items())
+    return RescheduleResult(
+        goal=optimization_goal,
+        holds=best_holds,
+        initial_cost=initial,
+        best_cost=best_cost,
+        iterations=iterations,
+        accepted=accepted,
+        elapsed_ms=(time.perf_counter() - clock) * 1000.0,
+        remaining_conflicts=sum(len(c) for c in best.block_conflicts.values()),
+        delays={tid: sum(h) for tid, h in best_holds.items()},
+    )
@@ -1,8 +1,11 @@
 from __future__ import annotations
 
+import bisect
 import json
 import os
-from typing import Dict, List, Tuple
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
 from scenario_schema import (
     Scenario,
     TrainInput,
@@ -13,16 +16,21 @@ from scenario_schema import (
     priority_value,
 )
 from rail_decision_engine import (
+    BlockKey,
     RailNetwork,
     Edge,
+    RouteCache,
     Train,
     BlockOccupancy,
+    OccupancyTable,
     detect_block_conflicts,
     decide_precedence,
-    propagate_delay_simple,
+    propagate_delays,
     run_simulation,
     compute_kpis,
 )
+from occupancy_index import OccupancyIndex
+from spacetime_router import SpaceTimeRouter
 from stations_csv_loader import load_stations_from_csv
 
 
@@ -57,127 +65,269 @@ def build_network(sections: List[TrackSectionInput]) -> RailNetwork:
         edges.setdefault(s.from_node, []).append(Edge(s.from_node, s.to_node, s.travel_time_min))
         if s.availability in ("double", "loop"):
             edges.setdefault(s.to_node, []).append(Edge(s.to_node, s.from_node, s.travel_time_min))
-    return RailNetwork(nodes=nodes, edges=edges)
+    network = RailNetwork(nodes=nodes, edges=edges)
+    # Intern blocks once: a single line is one block in both directions, double/loop lines
+    # get a block per direction. Capacities are keyed by the interned block id.
+    for s in sections:
+        bid = network.symbols.block(s.from_node, s.to_node, shared=s.availability not in ("double", "loop"))
+        network.capacities[bid] = s.section_capacity
+        if s.availability in ("double", "loop"):
+            network.capacities.setdefault(network.block_id(s.to_node, s.from_node), s.section_capacity)
+    return network
+
+
+def name_conflicts(
+    network: RailNetwork, conflicts: List[Tuple[BlockKey, str, str, Tuple[float, float]]]
+) -> List[Tuple[str, str, str, Tuple[float, float]]]:
+    # Convert interned block ids back to "u-v" labels for output
+    return [(network.symbols.block_name(b), a, c, w) for b, a, c, w in conflicts]
+
+
+# Shared across requests: entries are keyed by the network content hash
+ROUTE_CACHE = RouteCache()
+# Loopless routes compared per train when the scenario gives no alternative_route_path
+ROUTE_ALTERNATIVES = 5
 
 
 def shortest_path(sections: List[TrackSectionInput], start: str, end: str) -> List[str]:
-    # Simple Dijkstra to find shortest path by travel time
-    graph = {}
-    for s in sections:
-        graph.setdefault(s.from_node, []).append((s.to_node, s.travel_time_min))
-        if s.availability in ("double", "loop"):
-            graph.setdefault(s.to_node, []).append((s.from_node, s.travel_time_min))
-    
-    import heapq
-    queue = [(0, start, [])]
-    visited = set()
-    while queue:
-        cost, node, path = heapq.heappop(queue)
-        if node in visited:
-            continue
-        visited.add(node)
-        path = path + [node]
-        if node == end:
-            return path
-        for neighbor, weight in graph.get(node, []):
-            if neighbor not in visited:
-                heapq.heappush(queue, (cost + weight, neighbor, path))
-    return []  # no path
+    # Shortest path by travel time, served from the route cache
+    return ROUTE_CACHE.path(build_network(sections), start, end)
+
+
+class SectionIndex:
+    """O(1) lookup of the section running from one node to the next.
+
+    Built once per scenario. Forward entries take precedence (first listed section wins,
+    as the old linear scans did); double and loop lines are also registered in reverse,
+    since trains can run them both ways.
+    """
+
+    def __init__(self, sections: List[TrackSectionInput]) -> None:
+        self._by_pair: Dict[Tuple[str, str], TrackSectionInput] = {}
+        for s in sections:
+            self._by_pair.setdefault((s.from_node, s.to_node), s)
+        for s in sections:
+            if s.availability in ("double", "loop"):
+                self._by_pair.setdefault((s.to_node, s.from_node), s)
+
+    def get(self, u: str, v: str) -> Optional[TrackSectionInput]:
+        return self._by_pair.get((u, v))
+
+    def travel_time(self, u: str, v: str, default: float = 5.0) -> float:
+        s = self._by_pair.get((u, v))
+        return s.travel_time_min if s is not None else default
 
 
-def _estimate_travel_time(route: List[str], sections: List[TrackSectionInput]) -> float:
+def _estimate_travel_time(route: List[str], sections: SectionIndex) -> float:
     total = 0.0
     for i in range(len(route) - 1):
-        u = route[i]
-        v = route[i + 1]
-        tt = next((s.travel_time_min for s in sections if s.from_node == u and s.to_node == v), 5.0)
-        total += tt
+        total += sections.travel_time(route[i], route[i + 1])
     return total
 
 
-def _estimate_conflicts(route: List[str], trains_built: List[Train], sections: List[TrackSectionInput]) -> int:
-    # Build a hypothetical single train with zero-based occupancy along this route
-    current_time = 0.0
+def _route_occupancies(
+    route: List[str], sections: SectionIndex, network: RailNetwork, start: float = 0.0
+) -> List[BlockOccupancy]:
+    # Block occupancies of a train leaving at ``start`` and running this route without stops
+    current_time = start
     occ: List[BlockOccupancy] = []
     for i in range(len(route) - 1):
         u = route[i]
         v = route[i + 1]
-        block_id = f"{u}-{v}"
-        tt = next((s.travel_time_min for s in sections if s.from_node == u and s.to_node == v), 5.0)
-        occ.append(BlockOccupancy(block_id, current_time, current_time + tt))
+        tt = sections.travel_time(u, v)
+        occ.append(BlockOccupancy(network.block_id(u, v), current_time, current_time + tt))
         current_time += tt
-    probe = Train(train_id="__probe__", category="passenger", priority=1, planned_path=route, occupancies=occ)
-    conflicts = detect_block_conflicts(trains_built + [probe])
-    return sum(1 for c in conflicts if c[1] == "__probe__" or c[2] == "__probe__")
+    return occ
+
+
+def _estimate_conflicts(
+    route: List[str], index: OccupancyIndex, sections: SectionIndex, network: RailNetwork, start: float = 0.0
+) -> int:
+    # Price a hypothetical train along this route against the index
+    return index.count_conflicts(_route_occupancies(route, sections, network, start))
 
 
-def build_trains(scn: Scenario) -> List[Train]:
+def build_trains(
+    scn: Scenario,
+    index: Optional[OccupancyIndex] = None,
+    network: Optional[RailNetwork] = None,
+    departures: Optional[Dict[str, float]] = None,
+    routing: Optional[str] = None,
+    alternatives: int = ROUTE_ALTERNATIVES,
+) -> List[Train]:
+    # Block ids are interned in the network's symbol table; pass the network to map them back.
+    # Trains built so far are kept in an occupancy index so each candidate route is priced
+    # by probing it; pass an index to keep it around for later what-if queries.
+    # Trains start at time 0 unless ``departures`` gives their start time in minutes.
+    # ``routing`` overrides the scenario's routing_mode ("cost" or "spacetime"). In cost mode
+    # a train without alternative_route_path is priced over its ``alternatives`` shortest
+    # loopless routes (cached per OD pair and network); pass 1 to keep the main route only.
     trains: List[Train] = []
+    if network is None:
+        network = build_network(scn.sections)
+    if index is None:
+        index = OccupancyIndex(network.capacities)
+    if (routing or scn.simulation.routing_mode) == "spacetime":
+        return _build_trains_spacetime(scn, index, network, departures)
+    sections = SectionIndex(scn.sections)
     for t in scn.trains[: scn.simulation.num_trains]:
         prio = priority_value(t.priority_level)
+        start = departures.get(t.train_id, 0.0) if departures else 0.0
         # Compute route if not provided
-        main_route = t.route_path if t.route_path else shortest_path(scn.sections, t.source, t.destination)
+        main_route = t.route_path if t.route_path else ROUTE_CACHE.path(network, t.source, t.destination)
         if not main_route:
             print(f"Warning: no path found for train {t.train_id} from '{t.source}' to '{t.destination}' using loaded sections.")
             # Skip building occupancies for this train, continue to next
             continue
-        alt_route = t.alternative_route_path if t.alternative_route_path else None
-        # choose between main route and alternative using travel time + alpha * predicted conflicts
+        candidates = [main_route]
+        if t.alternative_route_path:
+            candidates.append(t.alternative_route_path)
+        elif alternatives > 1:
+            candidates.extend(
+                path for _, path in ROUTE_CACHE.alternatives(network, main_route[0], main_route[-1], alternatives)
+                if path != main_route
+            )
+        # choose the candidate with the lowest travel time + alpha * predicted conflicts (main wins ties)
         alpha = 30.0  # minutes penalty per predicted conflict
-        main_tt = _estimate_travel_time(main_route, scn.sections)
-        main_cf = _estimate_conflicts(main_route, trains, scn.sections) if trains else 0
-        main_cost = main_tt + alpha * main_cf
         chosen_route = main_route
-        if alt_route:
-            alt_tt = _estimate_travel_time(alt_route, scn.sections)
-            alt_cf = _estimate_conflicts(alt_route, trains, scn.sections) if trains else 0
-            alt_cost = alt_tt + alpha * alt_cf
-            if alt_cost < main_cost:
-                chosen_route = alt_route
-
-        occupancies: List[BlockOccupancy] = []
-        current_time = 0.0
-        for i in range(len(chosen_route) - 1):
-            u = chosen_route[i]
-            v = chosen_route[i + 1]
-            block_id = f"{u}-{v}"
-            tt = next((s.travel_time_min for s in scn.sections if s.from_node == u and s.to_node == v), 5.0)
-            occupancies.append(BlockOccupancy(block_id, current_time, current_time + tt))
-            current_time += tt
-        trains.append(
-            Train(
-                train_id=t.train_id,
-                category=t.train_type.lower(),
-                priority=prio,
-                planned_path=chosen_route,  # chosen main or alternative
-                occupancies=occupancies,
-                delay_minutes=0.0,
-            )
+        best_cost = float("inf")
+        for route in candidates:
+            cost = _estimate_travel_time(route, sections)
+            if index:
+                cost += alpha * _estimate_conflicts(route, index, sections, network, start)
+            if cost < best_cost:
+                chosen_route, best_cost = route, cost
+
+        occupancies = _route_occupancies(chosen_route, sections, network, start)
+        train = Train(
+            train_id=t.train_id,
+            category=t.train_type.lower(),
+            priority=prio,
+            planned_path=chosen_route,  # cheapest of the candidates
+            occupancies=occupancies,
+            delay_minutes=0.0,
         )
+        trains.append(train)
+        index.insert(train)
     return trains
 
 
-def enforce_headway(trains: List[Train], min_headway_min: float) -> None:
-    # For each block, ensure consecutive occupancies start at least headway apart; if not, shift later train
-    block_to_entries: Dict[str, List[Tuple[float, Train, BlockOccupancy]]] = {}
-    for t in trains:
-        for occ in t.occupancies:
-            block_to_entries.setdefault(occ.block_id, []).append((occ.start_time, t, occ))
-    for block_id, entries in block_to_entries.items():
-        entries.sort(key=lambda x: x[0])
-        last_time = None
-        for idx, (start, t, occ) in enumerate(entries):
-            if last_time is None:
-                last_time = start
-                continue
-            if start - last_time < min_headway_min:
-                delta = (min_headway_min - (start - last_time))
-                # shift all subsequent occupancies of this train forward by delta
-                for o in t.occupancies:
-                    o.start_time += delta
-                    o.end_time += delta
-                start += delta
-            last_time = start
+def _build_trains_spacetime(
+    scn: Scenario, index: OccupancyIndex, network: RailNetwork, departures: Optional[Dict[str, float]]
+) -> List[Train]:
+    # Highest priority first (then earliest departure), each train takes the earliest
+    # conflict-free path left by those before it and reserves it. A given route_path is
+    # kept and only timed. Held trains wait at stations, so their occupancies have gaps.
+    router = SpaceTimeRouter(network, index)
+    specs = scn.trains[: scn.simulation.num_trains]
+    start = {t.train_id: departures.get(t.train_id, 0.0) if departures else 0.0 for t in specs}
+    order = sorted(range(len(specs)), key=lambda i: (-priority_value(specs[i].priority_level), start[specs[i].train_id], i))
+    built: Dict[int, Train] = {}
+    for i in order:
+        t = specs[i]
+        if t.route_path:
+            planned = router.follow(t.route_path, start[t.train_id], t.train_id)
+        else:
+            planned = router.route(t.source, t.destination, start[t.train_id], t.train_id)
+        if planned is None:
+            print(f"Warning: no path found for train {t.train_id} from '{t.source}' to '{t.destination}' using loaded sections.")
+            continue
+        train = Train(
+            train_id=t.train_id,
+            category=t.train_type.lower(),
+            priority=priority_value(t.priority_level),
+            planned_path=planned.path,
+            occupancies=planned.occupancies,
+            delay_minutes=0.0,
+        )
+        router.reserve(train)
+        built[i] = train
+    return [built[i] for i in sorted(built)]
+
+
+@dataclass
+class HeadwayReport:
+    events_processed: int = 0  # block entries placed
+    rechecks: int = 0  # extra passes over a held train's legs
+    shifts: int = 0  # times a train was held
+    total_shift_min: float = 0.0
+    trains_shifted: int = 0
+    blocks_touched: int = 0  # blocks whose entries moved
+    elapsed_ms: float = 0.0
+
+
+def enforce_headway(
+    trains: List[Train], min_headway_min: float, index: Optional[OccupancyIndex] = None, now: float = -float("inf")
+) -> HeadwayReport:
+    # Trains are placed in order of their first block entry. Each is held by the smallest delay
+    # that keeps every leg not yet started by ``now`` at least the headway away from the entries
+    # already placed on its block; the hold shifts all of those legs (the whole train by default,
+    # i.e. a later departure). Placed entries never move again, so a single pass leaves every
+    # block headway-clean, and it terminates: a leg jumps past each placed entry at most once.
+    # Legs started before ``now`` are fixed and placed as they are. A hold is booked in the
+    # train's delay_minutes. Only the moved occupancies are re-indexed in ``index`` when one is given.
+    clock = time.perf_counter()
+    report = HeadwayReport()
+    # the tolerance absorbs rounding in the shift: a sub-ulp shortfall is not a conflict
+    gap = min_headway_min - 1e-9
+    placed: Dict[BlockKey, List[Tuple[float, int]]] = {}  # block -> sorted (entry time, train)
+    if now > -float("inf"):
+        # the fixed legs are read off the columnar table, already in (start, train) order per
+        # block, instead of one insort per leg
+        table = OccupancyTable.from_trains(trains)
+        for b, block_id in enumerate(table.block_names):
+            lo, hi = table.block_offsets[b], table.block_offsets[b + 1]
+            cut = bisect.bisect_left(table.start, now, lo, hi)
+            if cut > lo:
+                placed[block_id] = list(zip(table.start[lo:cut], table.train[lo:cut]))
+                report.events_processed += cut - lo
+    order = sorted(
+        range(len(trains)),
+        key=lambda ti: (trains[ti].occupancies[0].start_time if trains[ti].occupancies else float("inf"), ti),
+    )
+    moved: Dict[int, List[int]] = {}
+    for ti in order:
+        t = trains[ti]
+        legs = [k for k, o in enumerate(t.occupancies) if o.start_time >= now]
+        delta = 0.0
+        while True:
+            need = delta
+            for k in legs:
+                o = t.occupancies[k]
+                starts = placed.get(o.block_id)
+                if not starts:
+                    continue
+                entry = o.start_time + delta
+                lo = bisect.bisect_right(starts, (entry - gap, len(trains)))
+                hi = bisect.bisect_left(starts, (entry + gap, -1))
+                # clear the latest entry of another train that is too close on this block
+                close = [p for p, owner in starts[lo:hi] if owner != ti]
+                if close:
+                    need = max(need, close[-1] + min_headway_min - o.start_time)
+            if need == delta:
+                break
+            delta = need
+            report.rechecks += 1
+        if delta > 0.0:
+            for k in legs:
+                o = t.occupancies[k]
+                o.start_time += delta
+                o.end_time += delta
+            t.delay_minutes += delta
+            moved[ti] = legs
+            report.shifts += 1
+            report.total_shift_min += delta
+        for k in legs:
+            o = t.occupancies[k]
+            bisect.insort(placed.setdefault(o.block_id, []), (o.start_time, ti))
+            report.events_processed += 1
+    if index is not None:
+        for ti, legs in moved.items():
+            index.update(trains[ti], legs)
+    report.trains_shifted = len(moved)
+    report.blocks_touched = len({trains[ti].occupancies[k].block_id for ti, legs in moved.items() for k in legs})
+    report.elapsed_ms = (time.perf_counter() - clock) * 1000.0
+    return report
 
 
 def run_scenario_json(path: str, stations_csv: str = "", sections_csv: str = "") -> None:
@@ -202,14 +352,14 @@ def run_scenario_json(path: str, stations_csv: str = "", sections_csv: str = "")
         scn.stations = csv_stations
     # Note: sections are loaded from JSON, not CSV
     network = build_network(scn.sections)
-    trains = build_trains(scn)
+    trains = build_trains(scn, network=network)
     enforce_headway(trains, scn.constraints.min_headway_min)
-    conflicts = detect_block_conflicts(trains)
+    conflicts = detect_block_conflicts(trains, network.capacities)
     id_pairs = {tuple(sorted((a, b))) for _, a, b, _ in conflicts}
     decisions = decide_precedence(list(id_pairs), {t.train_id: t for t in trains})
     # Output format: conflicts and decisions only
     print("Conflicts:")
-    for c in conflicts:
+    for c in name_conflicts(network, conflicts):
         print(c)
     print("Decisions:")
     for tid, action in decisions.items():
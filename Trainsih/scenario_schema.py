@@ -1,6 +1,7 @@
 from __future__ import annotations
 
 from dataclasses import dataclass, field
+from datetime import datetime, time as dt_time
 from typing import List, Dict, Optional
 
 
@@ -53,6 +54,8 @@ class SimulationInput:
     num_trains: int = 0
     scenario_type: str = "normal"  # normal, congestion, emergency, festival
     optimization_goal: str = "prioritize_passenger"  # minimize_delay, maximize_throughput, prioritize_passenger, balance
+    simulation_mode: str = "replay"  # replay (log conflicts), blocking (trains queue at occupied blocks)
+    routing_mode: str = "cost"  # cost (travel time + conflict penalty), spacetime (reserve conflict-free paths in priority order)
 
 
 @dataclass
@@ -69,3 +72,16 @@ def priority_value(level: str) -> int:
     return m.get(level, 1)
 
 
+def clock_minutes(value: str) -> Optional[float]:
+    # "HH:MM", "HH:MM:SS" or an ISO timestamp -> minutes after midnight of the local
+    # clock reading (any UTC offset is ignored); None when empty
+    if not value:
+        return None
+    try:
+        clock = datetime.fromisoformat(value).time()
+    except ValueError:
+        try:
+            clock = dt_time.fromisoformat("0" + value if value[1:2] == ":" else value)  # "8:30"
+        except ValueError:
+            raise ValueError(f"not a HH:MM time: {value!r}") from None
+    return clock.hour * 60.0 + clock.minute + (clock.second + clock.microsecond / 1e6) / 60.0
@@ -0,0 +1,123 @@
+from __future__ import annotations
+
+import heapq
+from array import array
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from occupancy_index import PROBE_ID, OccupancyIndex
+from rail_decision_engine import BlockKey, BlockOccupancy, RailNetwork, Train, reverse_shortest_path_tree
+
+
+# -----------------------------
+# Space-time routing against a reservation table
+# -----------------------------
+
+
+@dataclass
+class SpaceTimePath:
+    path: List[str]
+    occupancies: List[BlockOccupancy] = field(default_factory=list)
+    arrival: float = 0.0
+    wait_min: float = 0.0  # time held at stations, including at the origin
+
+
+class SpaceTimeRouter:
+    """Earliest conflict-free routes over (station, time), reserved in an OccupancyIndex.
+
+    Trains may wait at stations for as long as they like but never inside a block, and a
+    block is entered only when ``index.earliest_free`` says the whole run fits under its
+    capacity. Because waiting is allowed, arriving earlier at a station never hurts, so
+    the search keeps one label per station (its earliest arrival) and A* guided by the
+    static shortest distance to the goal returns the earliest feasible arrival. Reserve
+    each result before routing the next train to plan a whole timetable in one pass.
+    """
+
+    def __init__(self, network: RailNetwork, index: Optional[OccupancyIndex] = None) -> None:
+        self.network = network
+        self.index = index if index is not None else OccupancyIndex(network.capacities)
+        self._version = -1
+        self._blocks = array("l")  # block id of each compiled edge
+        self._lower: Dict[str, List[float]] = {}  # goal -> static distance of every station to it
+
+    def _refresh(self) -> None:
+        g = self.network.compiled()
+        if self._version == g.version:
+            return
+        names = g.symbols.station_names
+        self._blocks = array("l", [0] * len(g.targets))
+        for u in range(g.num_nodes):
+            for k in range(g.offsets[u], g.offsets[u + 1]):
+                self._blocks[k] = self.network.block_id(names[u], names[g.targets[k]])
+        self._lower.clear()
+        self._version = g.version
+
+    def route(self, origin: str, goal: str, depart: float, train_id: str = PROBE_ID) -> Optional[SpaceTimePath]:
+        # A* on earliest arrival; ``train_id``'s own reservations are ignored so a train can be re-planned
+        self._refresh()
+        g = self.network.compiled()
+        s, t = g.node(origin), g.node(goal)
+        if s is None or t is None:
+            return None
+        if s == t:
+            return SpaceTimePath([origin], [], depart, 0.0)
+        lower = self._lower.get(goal)
+        if lower is None:
+            lower = reverse_shortest_path_tree(self.network, goal)[0]
+            self._lower[goal] = lower
+        if lower[s] == float("inf"):
+            return None
+        offsets, targets, weights = g.offsets, g.targets, g.weights
+        arrival = [float("inf")] * g.num_nodes
+        via: Dict[int, Tuple[int, float, int]] = {}  # station -> (previous station, entry time, edge)
+        done = [False] * g.num_nodes
+        arrival[s] = depart
+        pq: List[Tuple[float, float, int]] = [(depart + lower[s], depart, s)]
+        while pq:
+            _, a, u = heapq.heappop(pq)
+            if done[u]:
+                continue
+            done[u] = True
+            if u == t:
+                break
+            for k in range(offsets[u], offsets[u + 1]):
+                v = targets[k]
+                if done[v] or lower[v] == float("inf"):
+                    continue
+                enter = self.index.earliest_free(self._blocks[k], a, weights[k], exclude=train_id)
+                av = enter + weights[k]
+                if av < arrival[v]:
+                    arrival[v] = av
+                    via[v] = (u, enter, k)
+                    heapq.heappush(pq, (av + lower[v], av, v))
+        if not done[t]:
+            return None
+        names = g.symbols.station_names
+        result = SpaceTimePath([names[t]], arrival=arrival[t])
+        cur = t
+        while cur != s:
+            u, enter, k = via[cur]
+            result.occupancies.append(BlockOccupancy(self._blocks[k], enter, enter + weights[k]))
+            result.wait_min += enter - arrival[u]
+            result.path.append(names[u])
+            cur = u
+        result.path.reverse()
+        result.occupancies.reverse()
+        return result
+
+    def follow(self, path: List[str], depart: float, train_id: str = PROBE_ID) -> Optional[SpaceTimePath]:
+        # Fixed route: enter each block at its earliest free time; None if a hop has no edge
+        result = SpaceTimePath(list(path), arrival=depart)
+        for u, v in zip(path, path[1:]):
+            w = self.network.compiled().edge_weight(u, v)
+            if w is None:
+                return None
+            block: BlockKey = self.network.block_id(u, v)
+            enter = self.index.earliest_free(block, result.arrival, w, exclude=train_id)
+            result.occupancies.append(BlockOccupancy(block, enter, enter + w))
+            result.wait_min += enter - result.arrival
+            result.arrival = enter + w
+        return result
+
+    def reserve(self, train: Train) -> None:
+        self.index.insert(train)
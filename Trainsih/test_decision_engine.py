@@ -3,13 +3,45 @@ from rail_decision_engine import (
     BlockOccupancy,
     RailNetwork,
     Edge,
+    SymbolTable,
+    RouteCache,
     detect_block_conflicts,
+    contention_profile,
+    iter_block_conflicts,
+    has_conflict,
     decide_precedence,
     dijkstra_shortest_path,
-    propagate_delay_simple,
+    k_shortest_paths,
+    reroute_trains,
+    propagate_delays,
+    DelayGraph,
+    OccupancyTable,
     run_simulation,
+    iter_simulation,
+    FileEventSink,
+    CalendarQueue,
+    Simulator,
+    KpiAccumulator,
+    QuantileSketch,
     compute_kpis,
+    format_event,
 )
+from occupancy_index import OccupancyIndex
+from rescheduler import CONFLICT_WEIGHT, reschedule
+import io
+import random
+
+
+def _exp_frt(start: float = 0.0, scale: float = 1.0):
+    # The shared two-block fixture: EXP on A-B 0-5 / B-C 5-10, FRT on A-B 2-8 / B-C 8-14,
+    # optionally moved to ``start`` and stretched by ``scale`` (fractional times)
+    def at(x):
+        return start + scale * x
+
+    return [
+        Train("EXP", "passenger", 5, ["A", "B", "C"], [BlockOccupancy("A-B", at(0), at(5)), BlockOccupancy("B-C", at(5), at(10))]),
+        Train("FRT", "freight", 2, ["A", "B", "C"], [BlockOccupancy("A-B", at(2), at(8)), BlockOccupancy("B-C", at(8), at(14))]),
+    ]
 
 
 def scenario_conflict_and_precedence():
@@ -34,6 +66,128 @@ def scenario_conflict_and_precedence():
     return conflicts, decisions
 
 
+def scenario_precedence_components():
+    # Chain A-B-C plus an independent pair D-E: B yields to A, which frees C to proceed
+    trains = {
+        tid: Train(tid, "passenger", prio, ["X", "Y"])
+        for tid, prio in (("A", 5), ("B", 3), ("C", 1), ("D", 2), ("E", 4))
+    }
+    pairs = [("C", "B"), ("D", "E"), ("B", "A")]
+    decisions = decide_precedence(pairs, trains)
+    assert decisions == decide_precedence(list(reversed(pairs)), trains)
+    return decisions
+
+
+def scenario_capacity_conflicts():
+    # Double-capacity block: two overlapping trains fit, the third one conflicts
+    trains = [
+        Train(
+            train_id=f"T{i}",
+            category="passenger",
+            priority=3,
+            planned_path=["A", "B"],
+            occupancies=[BlockOccupancy("A-B", start, start + 10.0)],
+        )
+        for i, start in enumerate((0.0, 2.0, 4.0, 20.0))
+    ]
+    conflicts = detect_block_conflicts(trains, {"A-B": 2})
+    # the replay honours the same capacity, so its KPIs count exactly these pairs;
+    # T4 enters as T1 leaves, which is not an overlap
+    trains.append(Train("T4", "freight", 1, ["A", "B"], [BlockOccupancy("A-B", 12.0, 13.0)]))
+    kpis = KpiAccumulator()
+    log = run_simulation(trains, kpis, capacities={"A-B": 2})
+    assert kpis.result()["safety_violations"] == len(detect_block_conflicts(trains, {"A-B": 2})) == 2
+    assert [format_event(ev) for ev in log if ev.time == 12.0] == ["12.0 EXIT A-B T1", "12.0 ENTER A-B T4"]
+    return conflicts
+
+
+def scenario_index_probe():
+    # Only the probe's own conflicts are returned, without re-detecting the whole set
+    t1 = Train("T1", "passenger", 5, ["A", "B", "C"], [BlockOccupancy("A-B", 0.0, 5.0), BlockOccupancy("B-C", 5.0, 10.0)])
+    t2 = Train("T2", "freight", 2, ["B", "C"], [BlockOccupancy("B-C", 12.0, 20.0)])
+    index = OccupancyIndex.from_trains([t1, t2])
+    probe = [BlockOccupancy("A-B", 3.0, 8.0), BlockOccupancy("B-C", 8.0, 13.0)]
+    before = index.query_route(probe)
+    index.remove("T2")
+    after = index.query_route(probe)
+    return before, after
+
+
+def scenario_index_long_occupancy():
+    # A day-long freight on the block must not hide or widen probes once it is removed
+    index = OccupancyIndex()
+    index.insert(Train("FRT", "freight", 2, ["A", "B"], [BlockOccupancy("A-B", 0.0, 1440.0)]))
+    for i in range(50):
+        index.insert(Train(f"L{i:02d}", "local", 3, ["A", "B"], [BlockOccupancy("A-B", 10.0 * i, 10.0 * i + 4.0)]))
+    hits = index.overlapping("A-B", 101.0, 103.0)
+    index.remove("FRT")
+    after = index.overlapping("A-B", 101.0, 103.0)
+    assert [h[0] for h in hits] == ["FRT", "L10"] and [h[0] for h in after] == ["L10"]
+    assert index.earliest_free("A-B", 101.0, 5.0) == 104.0
+    return hits, after
+
+
+def scenario_symbol_interning():
+    # "A-B" -> "C" and "A" -> "B-C" would both be labelled "A-B-C" but are distinct blocks
+    symbols = SymbolTable()
+    first = symbols.block("A-B", "C")
+    second = symbols.block("A", "B-C")
+    single = symbols.block("X", "Y", shared=True)
+    assert first != second
+    assert symbols.find_block("Y", "X") == single
+    net = RailNetwork(nodes={"A", "B"}, edges={"A": [Edge("A", "B", 5.0)]})
+    try:
+        net.block_id("A", "Bb")  # a typo must not mint a new block
+    except KeyError:
+        pass
+    else:
+        raise AssertionError("unknown hop was interned")
+    return [symbols.block_name(b) for b in (first, second, single)]
+
+
+def scenario_reschedule():
+    # The freight train should be the one held so the express keeps its slot
+    result = reschedule(_exp_frt(), optimization_goal="prioritize_passenger", budget_ms=50.0)
+    assert result.remaining_conflicts == 0
+    # a loop train clashing on its second visit to a block is held there, not at its first
+    # visit; with nothing left to improve the search stops long before its budget
+    loop = Train("LOOP", "freight", 2, ["A", "B", "C"], [
+        BlockOccupancy("A-B", 0.0, 2.0), BlockOccupancy("B-C", 2.0, 4.0), BlockOccupancy("A-B", 10.0, 12.0)])
+    exp = Train("EXP", "passenger", 5, ["A", "B"], [BlockOccupancy("A-B", 9.0, 13.0)])
+    plans = [reschedule([loop, exp], optimization_goal="prioritize_passenger", budget_ms=5000.0, seed=s) for s in range(8)]
+    assert any("LOOP" in p.holds for p in plans)
+    for p in plans:
+        assert p.holds.get("LOOP", [0.0, 0.0, 3.0]) == [0.0, 0.0, 3.0], p.holds
+        assert p.remaining_conflicts == 0 and p.elapsed_ms < 1000.0, p
+    return result.delays, result.initial_cost, result.best_cost
+
+
+def scenario_reschedule_capacity():
+    # On 2-track blocks a hold can create or clear conflicts between two other trains; the
+    # reported cost must still be the plan's own: its remaining overlaps plus its holds
+    rng = random.Random(11)
+    costs = []
+    for seed in range(20):
+        trains = []
+        for i in range(8):
+            t, occs = rng.uniform(0.0, 20.0), []
+            for block in rng.sample(("A-B", "B-C", "STN"), 2):
+                run = rng.uniform(1.0, 6.0)
+                occs.append(BlockOccupancy(block, t, t + run))
+                t += run
+            trains.append(Train(f"T{i}", "local", 3, [], occs))
+        caps = {"STN": 2, "A-B": 2}
+        result = reschedule(trains, caps, optimization_goal="minimize_delay", budget_ms=20.0, seed=seed)
+        result.apply(trains)
+        conflicts = detect_block_conflicts(trains, caps)
+        overlap = sum(w[1] - w[0] for *_, w in conflicts)
+        assert result.remaining_conflicts == len(conflicts)
+        assert abs(result.best_cost - (CONFLICT_WEIGHT * overlap + sum(result.delays.values()))) < 1e-6
+        assert result.best_cost <= result.initial_cost + 1e-6
+        costs.append(round(result.best_cost, 2))
+    return costs
+
+
 def scenario_reroute():
     net = RailNetwork(
         nodes={"A", "B", "C", "D"},
@@ -47,6 +201,161 @@ def scenario_reroute():
     return dist, path
 
 
+def scenario_route_cache():
+    net = RailNetwork(
+        nodes={"A", "B", "C", "D"},
+        edges={
+            "A": [Edge("A", "B", 10.0), Edge("A", "D", 6.0)],
+            "B": [Edge("B", "C", 10.0)],
+            "D": [Edge("D", "C", 7.0)],
+        },
+    )
+    cache = RouteCache()
+    first = cache.path(net, "A", "C")
+    cache.path(net, "A", "B")  # served from the same origin tree
+    cache.path(net, "A", "C")
+    net.add_edge("A", "C", 5.0)  # new content hash, so the next lookup recomputes
+    changed = cache.path(net, "A", "C")
+    net.add_edge("C", "E", 2.0)  # a station the network has not seen before
+    assert dijkstra_shortest_path(net, "A", "E") == (7.0, ["A", "C", "E"])
+    try:
+        net.edges["C"].append(Edge("C", "A", 1.0))  # edits must go through add_edge
+    except AttributeError:
+        pass
+    else:
+        raise AssertionError("edges should be read-only")
+    return first, changed, (cache.hits, cache.misses)
+
+
+def scenario_k_shortest_paths():
+    net = RailNetwork(
+        nodes={"A", "B", "C", "D", "E"},
+        edges={
+            "A": [Edge("A", "B", 3.0), Edge("A", "C", 2.0)],
+            "B": [Edge("B", "D", 4.0)],
+            "C": [Edge("C", "B", 1.0), Edge("C", "D", 6.0), Edge("C", "E", 3.0)],
+            "E": [Edge("E", "D", 2.0)],
+        },
+    )
+    paths = k_shortest_paths(net, "A", "D", 10)
+    assert [cost for cost, _ in paths] == sorted(cost for cost, _ in paths)
+    assert len({tuple(p) for _, p in paths}) == len(paths) == 4  # every loopless route, once
+    cache = RouteCache()
+    cache.alternatives(net, "A", "D", 3)
+    assert cache.alternatives(net, "A", "D", 2) == paths[:2] and cache.hits == 1
+    return paths
+
+
+def scenario_batch_reroute():
+    # B-C closes; both trains bound for C turn away from one shared reverse tree
+    net = RailNetwork(
+        nodes={"A", "B", "C", "D"},
+        edges={
+            "A": [Edge("A", "B", 10.0), Edge("A", "D", 12.0)],
+            "B": [Edge("B", "C", 10.0), Edge("B", "D", 4.0)],
+            "D": [Edge("D", "C", 9.0)],
+        },
+    )
+    ab, bc = net.block_id("A", "B"), net.block_id("B", "C")
+    trains = [
+        Train("EXP", "passenger", 5, ["A", "B", "C"], [BlockOccupancy(ab, 0.0, 10.0), BlockOccupancy(bc, 10.0, 20.0)]),
+        Train("FRT", "freight", 2, ["A", "B", "C"], [BlockOccupancy(ab, 20.0, 30.0), BlockOccupancy(bc, 30.0, 40.0)]),
+        Train("LOC", "local", 3, ["A", "D"], [BlockOccupancy(net.block_id("A", "D"), 0.0, 12.0)]),
+    ]
+    closed = net.close_edges([("B", "C")])
+    result = reroute_trains(trains, net, closed, now=5.0, apply=True)
+    assert result.searches == 1 and not result.stranded
+    assert trains[0].planned_path == ["A", "B", "D", "C"] and trains[0].occupancies[0].end_time == 10.0
+    net.reopen_edges()
+    assert dijkstra_shortest_path(net, "B", "C") == (10.0, ["B", "C"])
+    # slowdowns apply to the original running time and are undone exactly
+    before = net.content_hash()
+    net.slow_edges([("B", "C")], 2.0)
+    net.slow_edges([("B", "C")], 1.5)
+    assert [e.weight for e in net.edges["B"] if e.v == "C"] == [15.0]
+    net.restore_edges()
+    assert net.content_hash() == before
+    net.slow_edges([("B", "C")], 3.0)
+    net.close_edges([("B", "C")])
+    net.restore_edges()
+    net.reopen_edges()
+    assert dijkstra_shortest_path(net, "B", "C") == (10.0, ["B", "C"])
+    return result.routes, result.arrival_change
+
+
+def scenario_delay_graph():
+    # EXP running late pushes FRT off B-C, which in turn pushes LOC off C-D: a two-level cascade
+    trains = [
+        Train("EXP", "passenger", 5, ["A", "B", "C"], [BlockOccupancy("A-B", 0.0, 5.0), BlockOccupancy("B-C", 5.0, 10.0)]),
+        Train("FRT", "freight", 2, ["B", "C", "D"], [BlockOccupancy("B-C", 12.0, 18.0), BlockOccupancy("C-D", 18.0, 24.0)]),
+        Train("LOC", "local", 3, ["C", "D"], [BlockOccupancy("C-D", 25.0, 30.0)]),
+        Train("EMU", "local", 3, ["X", "Y"], [BlockOccupancy("X-Y", 0.0, 5.0)]),
+    ]
+    graph = DelayGraph(trains)
+    assert graph.delays() == {"EXP": 0.0, "FRT": 0.0, "LOC": 0.0, "EMU": 0.0}
+    touched = graph.report_delay("EXP", 10.0)
+    assert touched < sum(len(t.occupancies) for t in trains)  # EMU is outside the cone
+    return graph.delays(), {tid: graph.eta(tid) for tid in ("FRT", "LOC")}, touched
+
+
+def scenario_delay_graph_precedence():
+    # The minimal demo's trains: the graph must hold the trains decide_precedence holds, so
+    # EXP205 keeps its path and the replay of the propagated plan is conflict-free
+    trains = [
+        Train("EXP205", "passenger", 5, ["A", "B", "C"], [BlockOccupancy("A-B", 0.0, 5.0), BlockOccupancy("B-C", 5.0, 10.0)], 15.0),
+        Train("LOC401", "local", 3, ["A", "D", "C"], [BlockOccupancy("A-D", 1.0, 7.0), BlockOccupancy("D-C", 7.0, 12.0)]),
+        Train("FRT309", "freight", 2, ["B", "C"], [BlockOccupancy("B-C", 4.0, 12.0)]),
+        Train("VandeBharath", "passenger", 1, ["A", "B", "C"], [BlockOccupancy("A-B", 2.0, 6.0), BlockOccupancy("B-C", 6.0, 11.0)]),
+    ]
+    pairs = {tuple(sorted((a, b))) for _, a, b, _ in detect_block_conflicts(trains)}
+    decisions = decide_precedence(list(pairs), {t.train_id: t for t in trains})
+    delays = propagate_delays(trains, apply=True, decisions=decisions).delays()
+    log = run_simulation(trains)
+    kpis = compute_kpis(trains, log)
+    assert delays["EXP205"] == 0.0 and kpis["safety_violations"] == 0, (delays, kpis)
+    assert not any(ev.kind.name in ("CONFLICT", "EXIT_WAIT") for ev in log), [format_event(ev) for ev in log]
+    assert {tid for tid, d in delays.items() if d > 0.0} <= {tid for tid, a in decisions.items() if a == "HOLD"}
+    return decisions, delays
+
+
+def scenario_shifted_delays():
+    # Shifting trains over the base graph must give exactly what a graph rebuilt over the
+    # shifted plan gives (delay reports replayed, new decisions), and leave the base alone
+    rng = random.Random(11)
+    checked = 0
+    for _ in range(300):
+        trains = []
+        for i in range(rng.randint(2, 12)):
+            t, occs = rng.uniform(0.0, 60.0), []
+            for _ in range(rng.randint(1, 4)):
+                run = rng.uniform(1.0, 8.0)
+                occs.append(BlockOccupancy(rng.choice(("A-B", "B-C", "C-D")), t, t + run))
+                t += run
+            trains.append(Train(f"T{i}", rng.choice(("passenger", "freight", "local")), rng.randint(1, 5), [], occs))
+        caps = {"C-D": 2}
+        decisions = {t.train_id: rng.choice(("PROCEED", "HOLD")) for t in trains}
+        graph = DelayGraph(trains, caps, decisions)
+        late = rng.choice(trains)
+        graph.report_delay(late.train_id, rng.uniform(0.0, 10.0), rng.randrange(len(late.occupancies)))
+        before = list(graph.start)
+        shifts = {t.train_id: rng.uniform(-20.0, 40.0) for t in rng.sample(trains, 2)}
+        redecided = dict(decisions, **{rng.choice(trains).train_id: "HOLD"})
+        got = graph.shifted_delays(shifts, redecided)
+        shifted = [
+            Train(t.train_id, t.category, t.priority, [],
+                  [BlockOccupancy(o.block_id, o.start_time + shifts.get(t.train_id, 0.0), o.end_time + shifts.get(t.train_id, 0.0)) for o in t.occupancies])
+            for t in trains
+        ]
+        rebuilt = DelayGraph(shifted, caps, redecided)
+        for tid, leg, delay in graph.log:
+            rebuilt.report_delay(tid, delay, leg)
+        want = {tid: d + shifts.get(tid, 0.0) for tid, d in rebuilt.delays().items()}
+        assert all(abs(got[tid] - want[tid]) < 1e-9 for tid in want), (got, want)
+        assert graph.start == before
+        checked += 1
+    return checked
+
+
 def scenario_delay_and_sim_kpis():
     t1 = Train(
         train_id="EXP",
@@ -65,29 +374,286 @@ def scenario_delay_and_sim_kpis():
         occupancies=[BlockOccupancy("B-C", 6.0, 12.0)],
     )
     trains = [t1, t2]
-    propagate_delay_simple(trains, added_delay_per_conflict=3.0)
+    # FRT is pushed behind EXP on B-C, so the replay has no conflict left
+    propagate_delays(trains, apply=True)
     log = run_simulation(trains)
     kpis = compute_kpis(trains, log)
+    assert trains[1].delay_minutes == 4.0 and kpis["safety_violations"] == 0, (trains, kpis)
     return trains, log, kpis
 
 
+def scenario_streaming_sinks():
+    # The generator must yield the same log as the batch run while feeding every sink
+    trains = _exp_frt()
+    out = io.StringIO()
+    acc = KpiAccumulator()
+    streamed = list(iter_simulation(trains, [acc, FileEventSink(out)]))
+    assert streamed == run_simulation(trains)
+    assert acc.result() == compute_kpis(trains, streamed)
+    return out.getvalue().splitlines()
+
+
+def scenario_quantile_small_sample():
+    # With two samples every tail quantile is the larger one, within the sketch's accuracy
+    sketch = QuantileSketch()
+    for v in (5.0, 3.0):
+        sketch.add(v)
+    got = {q: sketch.quantile(q) for q in (0.5, 0.95, 0.99)}
+    assert abs(got[0.5] - 3.0) <= 0.03 and abs(got[0.95] - 5.0) <= 0.05 and abs(got[0.99] - 5.0) <= 0.05, got
+    return got
+
+
+def scenario_blocking_simulation():
+    # A single-track block: FRT queues behind EXP, LOC (higher score) overtakes FRT in the queue
+    trains = [
+        *_exp_frt(),
+        Train("LOC", "local", 3, ["A", "B"], [BlockOccupancy("A-B", 3.0, 6.0)]),
+    ]
+    log = run_simulation(trains, blocking=True)
+    assert not any(ev.kind.name == "CONFLICT" for ev in log)
+    assert not detect_block_conflicts(trains)
+    return {t.train_id: t.delay_minutes for t in trains}, [format_event(ev) for ev in log]
+
+
+def scenario_blocking_random():
+    # Random fractional timetables on 1- and 2-track blocks: whatever the holds, the
+    # blocking run must leave no over-capacity overlap behind, not even by an ulp
+    rng = random.Random(5)
+    for _ in range(1000):
+        trains = []
+        for i in range(rng.randint(1, 8)):
+            t, occs = rng.uniform(0.0, 30.0), []
+            for _ in range(rng.randint(1, 4)):
+                run = rng.choice((rng.uniform(0.1, 7.0), 0.1, 0.7, 1 / 3))
+                occs.append(BlockOccupancy(rng.choice(("A-B", "B-C", "STN")), t, t + run))
+                t += run
+            trains.append(Train(f"T{i}", rng.choice(("passenger", "freight", "local")), rng.randint(1, 5), [], occs))
+        caps = {"STN": 2, "A-B": rng.randint(1, 2)}
+        run_simulation(trains, blocking=True, capacities=caps)
+        assert not detect_block_conflicts(trains, caps), [t.occupancies for t in trains]
+    return len(trains)
+
+
+def scenario_fractional_times():
+    # The same fixture at 0.35 + 0.7x minutes: nothing may rely on whole-minute times
+    trains = _exp_frt(start=0.35, scale=0.7)
+    conflicts = detect_block_conflicts(trains)
+    assert [(b, w) for b, *_, w in conflicts] == [("A-B", (0.35 + 1.4, 0.35 + 3.5)), ("B-C", (0.35 + 5.6, 0.35 + 7.0))]
+    assert reschedule(_exp_frt(start=0.35, scale=0.7), budget_ms=50.0).remaining_conflicts == 0
+    acc = KpiAccumulator()
+    log = run_simulation(trains, acc, blocking=True)
+    # FRT waits for EXP to clear A-B, and the shifted times leave no overlap behind
+    assert abs(trains[1].delay_minutes - 2.1) < 1e-9
+    assert not any(ev.kind.name == "CONFLICT" for ev in log) and not detect_block_conflicts(trains)
+    assert acc.result() == compute_kpis(trains, log)
+    return [format_event(ev) for ev in log]
+
+
+def scenario_calendar_queue():
+    # The bucketed scheduler must pop in exactly the heap's order, in both simulation modes
+    import random
+    rng = random.Random(3)
+
+    def make():
+        trains = []
+        for i in range(40):
+            s = rng.uniform(0.0, 30.0)
+            occ = []
+            for b in rng.sample(range(6), 3):
+                occ.append(BlockOccupancy(b, s, s + 2.5))
+                s += 2.5
+            trains.append(Train(f"T{i}", "freight", 1 + i % 4, [], occ))
+        return trains
+
+    trains = make()
+    assert run_simulation(trains, scheduler=CalendarQueue(0.7)) == run_simulation(trains)
+    rng.seed(3)
+    a = run_simulation(make(), blocking=True)
+    rng.seed(3)
+    b = run_simulation(make(), blocking=True, scheduler=CalendarQueue(0.7))
+    assert a == b
+    return len(a)
+
+
+def scenario_checkpoint_resume():
+    # Resuming from a mid-run snapshot must finish exactly like the uninterrupted run
+    def make():
+        return [
+            *_exp_frt(),
+            Train("LOC", "local", 3, ["A", "B"], [BlockOccupancy("A-B", 3.0, 6.0)]),
+        ]
+
+    full_kpis = KpiAccumulator()
+    full = run_simulation(make(), full_kpis, blocking=True)
+    snapshots = {}
+    head = run_simulation(make(), KpiAccumulator(), blocking=True, checkpoints=[6.0],
+                          on_checkpoint=lambda t, data: snapshots.__setitem__(t, data))
+    assert head == full
+    # the snapshot is plain state: resume it over trains rebuilt from the timetable
+    sim = Simulator.restore(snapshots[6.0], make())
+    branch = sim.fork()
+    tail = list(sim.events())
+    assert full[:len(full) - len(tail)] + tail == full
+    assert sim.sinks[0].result() == full_kpis.result()
+    # the branch runs FRT's last leg 4 minutes slower without touching the resumed run
+    branch.trains[1].occupancies[1].end_time += 4.0
+    branch_tail = [format_event(ev) for ev in branch.events()]
+    try:
+        Simulator.restore(snapshots[6.0], make()[:2])
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("snapshot restored over the wrong trains")
+    return len(snapshots[6.0]), branch_tail
+
+
+def scenario_filtered_conflicts():
+    # Probe-style queries see only the conflicts they ask for
+    trains = [
+        *_exp_frt(),
+        Train("LOC", "local", 3, ["C", "D"], [BlockOccupancy("C-D", 1.0, 4.0)]),
+        Train("EMU", "local", 3, ["C", "D"], [BlockOccupancy("C-D", 3.0, 6.0)]),
+    ]
+    involving = list(iter_block_conflicts(trains, involving=["LOC"]))
+    windowed = list(iter_block_conflicts(trains, time_window=(6.0, 20.0)))
+    assert has_conflict(trains, blocks=["B-C"]) and not has_conflict(trains, blocks=["A-B"], capacities={"A-B": 2})
+    return involving, windowed
+
+
+def scenario_occupancy_table():
+    # The columnar sweep reports the same conflicts, in the same order, as the object sweep
+    rng = random.Random(7)
+    for _ in range(300):
+        trains = []
+        for i in range(rng.randint(0, 8)):
+            t, occs = rng.choice((0.0, 0.5, 1.0, 2.0)), []
+            for _ in range(rng.randint(0, 4)):
+                run = rng.choice((0.0, 1.0, 2.0, 3.5))
+                occs.append(BlockOccupancy(rng.choice(("A-B", "B-C", "STN")), t, t + run))
+                t += run + rng.choice((0.0, 0.0, 1.0, -1.0))
+            trains.append(Train(f"T{i}", "local", 3, [], occs))
+        caps = {"STN": rng.randint(1, 3)}
+        table = OccupancyTable.from_trains(trains)
+        assert table.detect_conflicts(caps) == list(iter_block_conflicts(trains, capacities=caps))
+        assert [table.occupancies_for(i) for i in range(len(trains))] == [t.occupancies for t in trains]
+    # shifted columns write back to the trains they came from
+    trains = _exp_frt()
+    table = OccupancyTable.from_trains(trains)
+    for r in range(len(table)):
+        if table.train[r] == 1:
+            table.start[r] += 3.0
+            table.end[r] += 3.0
+    table.apply_to(trains)
+    assert [(o.start_time, o.end_time) for o in trains[1].occupancies] == [(5.0, 11.0), (11.0, 17.0)]
+    assert not detect_block_conflicts(trains)
+    return len(table), table.nbytes
+
+
+def scenario_contention_profile():
+    # 25 trains stacked in a 3-track station block: counts, not 300 pairs
+    trains = [
+        Train(f"T{i:02d}", "local", 1, ["S"], [BlockOccupancy("STN", float(i), float(i) + 10.0)]) for i in range(25)
+    ]
+    profile = contention_profile(trains, {"STN": 3})["STN"]
+    assert profile.peak == 10 and profile.over_capacity == [(3.0, 31.0)]
+    assert sum(1 for _ in profile.pairs()) == sum(min(i, 9) for i in range(25))
+    return profile.peak, profile.over_capacity_min, profile.count_at(12.5)
+
+
 def main():
     print("== Conflict & Precedence ==")
     conflicts, decisions = scenario_conflict_and_precedence()
     print("Conflicts:", conflicts)
     print("Decisions:", decisions)
 
+    print("\n== Precedence over conflict components ==")
+    print("Decisions:", scenario_precedence_components())
+
+    print("\n== Capacity-aware conflicts ==")
+    print("Conflicts:", scenario_capacity_conflicts())
+
+    print("\n== Filtered conflict queries ==")
+    involving, windowed = scenario_filtered_conflicts()
+    print("Involving LOC:", involving)
+    print("Overlapping 6-20 min:", windowed)
+
+    print("\n== Columnar occupancy table ==")
+    rows, nbytes = scenario_occupancy_table()
+    print("Rows:", rows, "bytes:", nbytes)
+
+    print("\n== Contention profile ==")
+    peak, over_min, at = scenario_contention_profile()
+    print("Peak:", peak, "minutes over capacity:", over_min, "trains at 12.5:", at)
+
+    print("\n== Occupancy index probe ==")
+    before, after = scenario_index_probe()
+    print("With T2:", before)
+    print("Without T2:", after)
+
+    print("\n== Index with a long occupancy ==")
+    hits, after = scenario_index_long_occupancy()
+    print("With FRT:", hits, "without:", after)
+
+    print("\n== Symbol interning ==")
+    print("Blocks:", scenario_symbol_interning())
+
+    print("\n== Local-search rescheduling ==")
+    delays, initial, best = scenario_reschedule()
+    print("Holds:", delays, "cost:", initial, "->", best)
+    print("Costs on 2-track blocks:", scenario_reschedule_capacity())
+
     print("\n== Rerouting (Dijkstra) ==")
     dist, path = scenario_reroute()
     print("Distance:", dist)
     print("Path:", path)
 
+    print("\n== K shortest loopless paths ==")
+    for cost, path in scenario_k_shortest_paths():
+        print(f"{cost:>5.1f}", path)
+
+    print("\n== Batched rerouting after a closure ==")
+    routes, change = scenario_batch_reroute()
+    print("Routes:", routes, "arrival change:", change)
+
+    print("\n== Route cache ==")
+    first, changed, stats = scenario_route_cache()
+    print("Before edge added:", first, "after:", changed, "hits/misses:", stats)
+
+    print("\n== Streaming simulation ==")
+    print("File sink:", scenario_streaming_sinks())
+    print("Small-sample quantiles:", scenario_quantile_small_sample())
+
+    print("\n== Blocking simulation ==")
+    delays, log = scenario_blocking_simulation()
+    print("Delays:", delays)
+    print("Log:", log)
+
+    print("Fractional times:", scenario_fractional_times())
+    print("Random timetables, last one with", scenario_blocking_random(), "trains: no conflicts left")
+
+    print("\n== Calendar-queue scheduler ==")
+    print("Blocking events, same order as the heap:", scenario_calendar_queue())
+
+    print("\n== Checkpoint and resume ==")
+    size, branch_tail = scenario_checkpoint_resume()
+    print("Snapshot bytes:", size, "branch tail:", branch_tail)
+
+    print("\n== Delay propagation graph ==")
+    delays, etas, touched = scenario_delay_graph()
+    print("Delays:", delays, "ETAs:", etas, "nodes re-evaluated:", touched)
+
+    print("\n== Delay graph following precedence ==")
+    decisions, delays = scenario_delay_graph_precedence()
+    print("Decisions:", decisions, "delays:", delays)
+
+    print("Shifted over the base graph, same as rebuilt:", scenario_shifted_delays(), "cases")
+
     print("\n== Delay Propagation, Simulation, KPIs ==")
     trains, log, kpis = scenario_delay_and_sim_kpis()
     print("Delays:", {t.train_id: t.delay_minutes for t in trains})
     print("Sim log:")
-    for line in log:
-        print(line)
+    for ev in log:
+        print(format_event(ev))
     print("KPIs:", kpis)
 
 
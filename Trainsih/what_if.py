@@ -0,0 +1,232 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import math
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Set, Tuple
+
+from occupancy_index import OccupancyIndex
+from rail_decision_engine import BlockKey, BlockOccupancy, DelayGraph, RailNetwork, Train, precedence_rank, solve_component
+from scenario_schema import Scenario
+from scenario_runner import build_network, build_trains, decide_precedence, detect_block_conflicts, enforce_headway, parse_scenario
+
+
+# -----------------------------
+# Incremental what-if evaluation
+# -----------------------------
+
+
+Conflict = Tuple[BlockKey, str, str, Tuple[float, float]]
+# conflicts compared without orientation: (block, lower id, higher id, overlap)
+ConflictKey = Tuple[BlockKey, str, str, Tuple[float, float]]
+
+
+def _conflict_key(c: Conflict) -> ConflictKey:
+    a, b = sorted((c[1], c[2]))
+    return (c[0], a, b, c[3])
+
+
+def _adjacency(keys) -> Dict[str, Set[str]]:
+    adjacency: Dict[str, Set[str]] = {}
+    for _, a, b, _ in keys:
+        if a != b:
+            adjacency.setdefault(a, set()).add(b)
+            adjacency.setdefault(b, set()).add(a)
+    return adjacency
+
+
+def plan_kpis(delays: Dict[str, float], conflicts: int, decisions: Dict[str, str], punctual_threshold_min: float = 0.01) -> Dict[str, float]:
+    # Plan-level KPIs from propagated arrival delays; cheap enough to recompute per query
+    values = sorted(delays.values())
+    n = max(1, len(values))
+    p95 = values[min(len(values) - 1, math.ceil(0.95 * len(values)) - 1)] if values else 0.0
+    return {
+        "average_delay": sum(values) / n,
+        "max_delay": values[-1] if values else 0.0,
+        "delay_p95": p95,
+        "punctuality": 100.0 * sum(1 for d in values if d <= punctual_threshold_min) / n,
+        "conflicts": float(conflicts),
+        "holds": float(sum(1 for a in decisions.values() if a == "HOLD")),
+    }
+
+
+@dataclass
+class BaseState:
+    """Compiled base run kept around for what-if queries.
+
+    Holds the headway-enforced trains, their occupancy index, the conflicts grouped by
+    block, the conflict graph, the precedence decisions, a DelayGraph for knock-on
+    delays and the base KPIs. ``what_if`` only reads it, so concurrent queries can
+    share one base state.
+    """
+
+    network: RailNetwork
+    trains: Dict[str, Train]
+    index: OccupancyIndex
+    conflicts: Dict[BlockKey, List[ConflictKey]]
+    adjacency: Dict[str, Set[str]]
+    pair_count: Dict[Tuple[str, str], int]  # conflicts per (lower id, higher id) pair
+    decisions: Dict[str, str]
+    delays: DelayGraph
+    kpis: Dict[str, float] = field(default_factory=dict)
+
+    @classmethod
+    def from_trains(cls, trains: List[Train], network: RailNetwork) -> "BaseState":
+        index = OccupancyIndex.from_trains(trains, network.capacities)
+        by_block: Dict[BlockKey, List[ConflictKey]] = {}
+        for c in detect_block_conflicts(trains, network.capacities):
+            by_block.setdefault(c[0], []).append(_conflict_key(c))
+        keys = [k for ks in by_block.values() for k in ks]
+        adjacency = _adjacency(keys)
+        pair_count: Dict[Tuple[str, str], int] = {}
+        for _, a, b, _ in keys:
+            pair_count[(a, b)] = pair_count.get((a, b), 0) + 1
+        pairs = [p for p in pair_count if p[0] != p[1]]
+        by_id = {t.train_id: t for t in trains}
+        decisions = decide_precedence(pairs, by_id)
+        graph = DelayGraph(trains, network.capacities, decisions)
+        state = cls(network, by_id, index, by_block, adjacency, pair_count, decisions, graph)
+        state.kpis = plan_kpis(graph.delays(), len(keys), decisions)
+        return state
+
+
+def build_base_state(scn: Scenario) -> BaseState:
+    network = build_network(scn.sections)
+    index = OccupancyIndex(network.capacities)
+    trains = build_trains(scn, index=index, network=network)
+    enforce_headway(trains, scn.constraints.min_headway_min, index)
+    return BaseState.from_trains(trains, network)
+
+
+@dataclass
+class WhatIfResult:
+    perturbations: Dict[str, float]
+    added_conflicts: List[Conflict] = field(default_factory=list)  # block ids named "u-v"
+    removed_conflicts: List[Conflict] = field(default_factory=list)
+    changed_decisions: Dict[str, Tuple[Optional[str], Optional[str]]] = field(default_factory=dict)  # id -> (base, new)
+    kpis: Dict[str, float] = field(default_factory=dict)
+    kpi_delta: Dict[str, float] = field(default_factory=dict)
+    delay_changes: Dict[str, float] = field(default_factory=dict)  # trains whose arrival delay moved
+    elapsed_ms: float = 0.0
+
+
+def what_if(base: BaseState, perturbations: Dict[str, float]) -> WhatIfResult:
+    """Evaluate "these trains depart ``d`` minutes late" against the base run.
+
+    Only the perturbed trains move. Conflicts are re-swept on the blocks they use (from
+    the occupancy index, with the moved trains overlaid), precedence is re-solved on
+    the conflict components that touch a changed pair, and knock-on delays come from the
+    base DelayGraph shifted in place of a rebuild: only the blocks of the moved and
+    re-decided trains are re-ordered, so a train delayed past its follower on a block
+    also swaps order with it there. Headway is not re-enforced for the shifted trains.
+    The base state is never modified.
+    """
+    clock = time.perf_counter()
+    result = WhatIfResult(perturbations=dict(perturbations))
+    moved = {tid: d for tid, d in perturbations.items() if tid in base.trains}
+    symbols = base.network.symbols
+    # conflicts on the blocks the moved trains use, sweeping them at their shifted times
+    shifted: Dict[str, List[BlockOccupancy]] = {
+        tid: [BlockOccupancy(o.block_id, o.start_time + d, o.end_time + d) for o in base.trains[tid].occupancies]
+        for tid, d in moved.items()
+    }
+    blocks: Dict[BlockKey, None] = {}
+    for tid in moved:
+        blocks.update(dict.fromkeys(o.block_id for o in base.trains[tid].occupancies))
+    added: List[ConflictKey] = []
+    removed: List[ConflictKey] = []
+    for b in blocks:
+        old = set(base.conflicts.get(b, ()))
+        new = {_conflict_key(c) for c in base.index.block_conflicts(b, shifted)}
+        added.extend(sorted(new - old, key=repr))
+        removed.extend(sorted(old - new, key=repr))
+    result.added_conflicts = [(symbols.block_name(b), a, c, w) for b, a, c, w in added]
+    result.removed_conflicts = [(symbols.block_name(b), a, c, w) for b, a, c, w in removed]
+
+    # precedence: re-solve every component (old or new) that contains a touched train
+    count: Dict[Tuple[str, str], int] = {}
+    for _, a, b, _ in removed:
+        count[(a, b)] = count.get((a, b), base.pair_count[(a, b)]) - 1
+    for _, a, b, _ in added:
+        count[(a, b)] = count.get((a, b), base.pair_count.get((a, b), 0)) + 1
+    adjacency = dict(base.adjacency)
+    for (a, b), n in count.items():
+        if a == b:
+            continue
+        for x, y in ((a, b), (b, a)):
+            nbrs = set(adjacency.get(x, ()))
+            if n > 0:
+                nbrs.add(y)
+            else:
+                nbrs.discard(y)
+            adjacency[x] = nbrs
+    seeds = set(moved) | {x for _, a, b, _ in added + removed for x in (a, b)}
+    region: Set[str] = set()
+    stack = list(seeds)
+    while stack:
+        tid = stack.pop()
+        if tid in region:
+            continue
+        region.add(tid)
+        stack.extend(base.adjacency.get(tid, ()))
+        stack.extend(adjacency.get(tid, ()))
+    decisions = {tid: a for tid, a in base.decisions.items() if tid not in region}
+    seen: Set[str] = set()
+    for tid in sorted(region, key=lambda x: precedence_rank(base.trains[x])):
+        if tid in seen or not adjacency.get(tid):
+            continue
+        # connected component of the new conflict graph, solved like decide_precedence
+        members, stack = [], [tid]
+        while stack:
+            x = stack.pop()
+            if x in seen:
+                continue
+            seen.add(x)
+            members.append(x)
+            stack.extend(adjacency.get(x, ()))
+        ranked = sorted(members, key=lambda x: precedence_rank(base.trains[x]))
+        decisions.update(solve_component(ranked, {x: adjacency[x] for x in ranked}))
+    for tid in region:
+        before, after = base.decisions.get(tid), decisions.get(tid)
+        if before != after:
+            result.changed_decisions[tid] = (before, after)
+
+    # knock-on delays: the base graph with the moved trains shifted and the new decisions,
+    # re-propagated from the blocks they touch (the base graph itself is not modified)
+    base_delays = base.delays.delays()
+    delays = base.delays.shifted_delays(moved, decisions) if moved else base_delays
+    result.delay_changes = {tid: d - base_delays[tid] for tid, d in delays.items() if abs(d - base_delays[tid]) > 1e-9}
+
+    conflicts = sum(len(v) for v in base.conflicts.values()) + len(added) - len(removed)
+    result.kpis = plan_kpis(delays, conflicts, decisions)
+    result.kpi_delta = {k: v - base.kpis.get(k, 0.0) for k, v in result.kpis.items()}
+    result.elapsed_ms = (time.perf_counter() - clock) * 1000.0
+    return result
+
+
+# Base states of recently seen scenarios, keyed by a hash of the scenario JSON; the
+# lock covers the LRU bookkeeping (request threads share it), not building a state
+BASE_CACHE: "OrderedDict[str, BaseState]" = OrderedDict()
+BASE_CACHE_SIZE = 16
+_BASE_CACHE_LOCK = threading.Lock()
+
+
+def cached_base_state(obj: dict) -> BaseState:
+    key = hashlib.sha1(json.dumps(obj, sort_keys=True).encode("utf-8")).hexdigest()
+    with _BASE_CACHE_LOCK:
+        state = BASE_CACHE.get(key)
+        if state is not None:
+            BASE_CACHE.move_to_end(key)
+            return state
+    state = build_base_state(parse_scenario(obj))
+    with _BASE_CACHE_LOCK:
+        # another thread may have built it meanwhile: keep the first one
+        state = BASE_CACHE.setdefault(key, state)
+        BASE_CACHE.move_to_end(key)
+        if len(BASE_CACHE) > BASE_CACHE_SIZE:
+            BASE_CACHE.popitem(last=False)
+    return state